@@ -0,0 +1,462 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from werkzeug.serving import make_server
+
+import main
+from main import MATCHER_BACKENDS, build_keyword_matcher
+
+SYLLABLES = ['ра', 'зра', 'бот', 'ка', 'про', 'цес', 'сор', 'ком', 'пью', 'тер',
+             'тех', 'но', 'ло', 'ги', 'я', 'да', 'нн', 'ые', 'сеть', 'ин']
+
+def log(message):
+    # Ход замеров печатается в stderr, чтобы stdout оставался чистым JSON
+    print(message, file=sys.stderr)
+
+def random_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def generate_keywords(rng, count):
+    words = set()
+    while len(words) < count:
+        words.add(random_word(rng))
+    return list(enumerate(sorted(words), start=1))
+
+def generate_entry(rng, words_per_entry):
+    title = ' '.join(random_word(rng) for _ in range(8)).capitalize()
+    content = ' '.join(random_word(rng) for _ in range(words_per_entry))
+    return title, '<p>' + content + '</p>'
+
+def generate_entries(rng, count, words_per_entry):
+    return [generate_entry(rng, words_per_entry) for _ in range(count)]
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'p50_ms': round(pick(0.5), 3),
+        'p90_ms': round(pick(0.9), 3),
+        'p99_ms': round(pick(0.99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+class FakeFeedServer:
+    # Локальная замена RSS-источников: лента /feed/<n> содержит entries
+    # записей, детерминированных по seed, и отвечает с задержкой latency.
+    # Поддерживаются ETag и 304, как у настоящих лент
+    def __init__(self, seed, entries, words, latency):
+        self.seed = seed
+        self.entries = entries
+        self.words = words
+        self.latency = latency
+        self.feeds = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def feed_url(self, number):
+        return f'{self.base_url}/feed/{number}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def render(self, number):
+        with self.lock:
+            if number in self.feeds:
+                return self.feeds[number]
+
+        rng = random.Random(f'{self.seed}-{number}')
+        now = datetime.now().astimezone()
+        items = []
+        for index in range(self.entries):
+            title, content = generate_entry(rng, self.words)
+            published = format_datetime(now - timedelta(minutes=index * 30))
+            items.append(f'<item><title>{title}</title>'
+                         f'<link>http://bench.local/feed/{number}/{index}?utm_source=rss</link>'
+                         f'<description><![CDATA[{content}]]></description>'
+                         f'<pubDate>{published}</pubDate></item>')
+        body = ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+                f'<title>Лента {number}</title><link>http://bench.local/feed/{number}</link>'
+                + ''.join(items) + '</channel></rss>').encode('utf-8')
+        feed = (body, f'"{self.seed}-{number}"')
+        with self.lock:
+            self.feeds[number] = feed
+        return feed
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                if len(parts) != 2 or parts[0] != 'feed' or not parts[1].isdigit():
+                    self.send_error(404)
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+
+                body, etag = server.render(int(parts[1]))
+                with server.lock:
+                    server.requests += 1
+                if self.headers.get('If-None-Match') == etag:
+                    with server.lock:
+                        server.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                with server.lock:
+                    server.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/rss+xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def use_temporary_db(directory):
+    main.DB_PATH = os.path.join(directory, 'bench.db')
+    main.ARCHIVE_DB_PATH = os.path.join(directory, 'bench_archive.db')
+    main.init_db()
+
+def populate_catalog(conn, keywords, source_urls):
+    # Источники и ключевые слова; возвращает id источников
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO keywords (id, word) VALUES (?, ?)", keywords)
+    source_ids = []
+    for number, url in enumerate(source_urls):
+        cursor.execute("INSERT INTO sources (name, url) VALUES (?, ?)", (f'Лента {number}', url))
+        source_ids.append(cursor.lastrowid)
+    conn.commit()
+    return source_ids
+
+def populate_news(conn, rng, count, source_ids, keywords, words_per_entry, fingerprints=False, batch=1000):
+    # Заполнение news без сборщика: записи раскладываются по источникам и
+    # датам за последние 90 дней, каждой назначаются 1-3 ключевых слова
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM news")
+    offset = cursor.fetchone()[0]
+    now = datetime.now()
+    keyword_ids = [keyword_id for keyword_id, _ in keywords]
+
+    for start in range(0, count, batch):
+        with conn:
+            for number in range(offset + start, offset + min(start + batch, count)):
+                title, content = generate_entry(rng, words_per_entry)
+                found = (now - timedelta(seconds=rng.randint(0, 90 * 86400))).isoformat()
+                cursor.execute('''
+                INSERT INTO news (title, content, summary, url, source_id, published_date, found_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (title, content, main.make_summary(content), f'http://bench.local/news/{number}',
+                      rng.choice(source_ids), found, found))
+                news_id = cursor.lastrowid
+                cursor.executemany("INSERT OR IGNORE INTO news_keywords (news_id, keyword_id) VALUES (?, ?)",
+                                   [(news_id, keyword_id) for keyword_id in rng.sample(keyword_ids, rng.randint(1, 3))])
+                if fingerprints:
+                    main.store_news_fingerprint(cursor, news_id, main.news_fingerprint(title, content))
+
+def bench_matcher(args):
+    rng = random.Random(args.seed)
+    keywords = generate_keywords(rng, args.keywords)
+    entries = generate_entries(rng, args.entries, args.words)
+
+    results = {}
+    matches_by_backend = {}
+    for backend in MATCHER_BACKENDS:
+        started = time.perf_counter()
+        matcher = build_keyword_matcher(keywords, backend)
+        build_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        matches = [matcher.match(title, content) for title, content in entries]
+        match_time = time.perf_counter() - started
+
+        matches_by_backend[backend] = matches
+        results[backend] = {
+            'build_ms': round(build_time * 1000, 3),
+            'per_entry_us': round(match_time / len(entries) * 1e6, 1),
+            'matches': sum(len(m) for m in matches),
+        }
+        log(f"{backend:>14}: сборка {build_time * 1000:8.2f} мс, "
+            f"{match_time / len(entries) * 1e6:10.1f} мкс на запись, "
+            f"совпадений {results[backend]['matches']}")
+
+    reference = matches_by_backend['regex']
+    for backend, matches in matches_by_backend.items():
+        results[backend]['consistent'] = [sorted(m) for m in matches] == [sorted(m) for m in reference]
+        if not results[backend]['consistent']:
+            log(f"ВНИМАНИЕ: результаты {backend} отличаются от regex")
+    return results
+
+def bench_ingest(args):
+    # Полный первый проход сборщика по feeds лентам фальшивого сервера
+    rng = random.Random(args.seed)
+    keywords = generate_keywords(rng, args.keywords)
+    server = FakeFeedServer(args.seed, args.entries, args.words, args.latency).start()
+    main.PARSE_PROCESSES = args.parse_processes
+    main.FETCH_HOST_LIMIT = args.host_limit
+    # Без разброса первого опроса, иначе он займёт большую часть замера
+    main.POLL_JITTER = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_temporary_db(directory)
+        conn = main.connect_db()
+        source_ids = populate_catalog(conn, keywords, [server.feed_url(n) for n in range(args.feeds)])
+
+        stop_event = threading.Event()
+        fetcher = threading.Thread(target=main.fetch_rss_news, args=(stop_event,), daemon=True)
+        started = time.perf_counter()
+        fetcher.start()
+        while time.perf_counter() - started < args.timeout:
+            with main.fetcher_metrics.lock:
+                polled = sum(1 for source_id in source_ids if main.fetcher_metrics.history.get(source_id))
+            if polled == len(source_ids):
+                break
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        stop_event.set()
+        fetcher.join(timeout=args.timeout)
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM news")
+        stored = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM unmatched_entries")
+        unmatched = cursor.fetchone()[0]
+        conn.close()
+    server.stop()
+
+    samples = [sample for source_id in source_ids for sample in main.fetcher_metrics.recent(source_id)]
+    entries = sum(sample.get('entries') or 0 for sample in samples)
+    result = {
+        'polled_sources': len(samples),
+        'elapsed_s': round(elapsed, 3),
+        'entries': entries,
+        'entries_per_s': round(entries / elapsed, 1),
+        'news_stored': stored,
+        'unmatched_kept': unmatched,
+        'errors': sum(1 for sample in samples if sample.get('error')),
+        'bytes': server.bytes_sent,
+    }
+    for field in ('fetch_seconds', 'parse_seconds', 'match_seconds', 'write_seconds', 'total_seconds'):
+        result[field] = percentiles([sample[field] for sample in samples if sample.get(field) is not None])
+    log(f"Опрошено {len(samples)} лент за {elapsed:.2f} с: {entries} записей "
+        f"({result['entries_per_s']} в секунду), сохранено новостей {stored}")
+    return result
+
+API_SCENARIOS = ['news_list', 'news_keyword', 'news_source', 'news_search', 'sources']
+
+def api_path(rng, scenario, keywords, source_ids):
+    word = urllib.parse.quote(rng.choice(keywords)[1])
+    if scenario == 'news_list':
+        return '/news/?limit=100'
+    if scenario == 'news_keyword':
+        return f'/news/?keyword={word}&limit=50'
+    if scenario == 'news_source':
+        return f'/news/?source_id={rng.choice(source_ids)}&limit=50'
+    if scenario == 'news_search':
+        return f'/news/search?q={word}&limit=20'
+    return '/sources/'
+
+def bench_api(args):
+    # Задержка ответов API под конкурентной нагрузкой на заполненной базе
+    rng = random.Random(args.seed)
+    keywords = generate_keywords(rng, args.keywords)
+    if args.no_cache:
+        main.CACHED_ENDPOINTS = set()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_temporary_db(directory)
+        conn = main.connect_db()
+        source_ids = populate_catalog(conn, keywords, [f'http://bench.local/feed/{n}' for n in range(args.sources)])
+        started = time.perf_counter()
+        populate_news(conn, rng, args.news, source_ids, keywords, args.words)
+        log(f"Заполнено {args.news} новостей за {time.perf_counter() - started:.1f} с")
+        conn.close()
+
+        server = make_server('127.0.0.1', 0, main.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        latencies = {scenario: [] for scenario in API_SCENARIOS}
+        failures = []
+        lock = threading.Lock()
+
+        def client(worker):
+            client_rng = random.Random(f'{args.seed}-{worker}')
+            for _ in range(args.requests):
+                scenario = client_rng.choice(API_SCENARIOS)
+                path = api_path(client_rng, scenario, keywords, source_ids)
+                request_started = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(base_url + path, timeout=60) as response:
+                        response.read()
+                except Exception as e:
+                    with lock:
+                        failures.append(f'{path}: {e}')
+                    continue
+                elapsed = time.perf_counter() - request_started
+                with lock:
+                    latencies[scenario].append(elapsed)
+
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client, args=(worker,)) for worker in range(args.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+
+    total = sum(len(values) for values in latencies.values())
+    result = {
+        'requests': total,
+        'failures': len(failures),
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(total / elapsed, 1),
+        'all': percentiles([value for values in latencies.values() for value in values]),
+        'endpoints': {scenario: percentiles(values) for scenario, values in latencies.items()},
+    }
+    for scenario, stats in result['endpoints'].items():
+        if stats:
+            log(f"{scenario:>14}: p50 {stats['p50_ms']:8.2f} мс, p99 {stats['p99_ms']:8.2f} мс ({stats['count']} запросов)")
+    for failure in failures[:5]:
+        log(f"Ошибка запроса {failure}")
+    return result
+
+def bench_growth(args):
+    # Размер базы по таблицам и индексам по мере роста news
+    rng = random.Random(args.seed)
+    keywords = generate_keywords(rng, args.keywords)
+    steps = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_temporary_db(directory)
+        conn = main.connect_db()
+        source_ids = populate_catalog(conn, keywords, [f'http://bench.local/feed/{n}' for n in range(args.sources)])
+        step_size = args.news // args.steps
+        for step in range(1, args.steps + 1):
+            started = time.perf_counter()
+            populate_news(conn, rng, step_size, source_ids, keywords, args.words, fingerprints=True)
+            insert_time = time.perf_counter() - started
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            report = main.storage_report(conn)
+            news_count = step * step_size
+            steps.append({
+                'news': news_count,
+                'insert_per_news_ms': round(insert_time / step_size * 1000, 3),
+                'file_bytes': report['file_bytes'],
+                'bytes_per_news': round(report['file_bytes'] / news_count, 1),
+                'objects': {item['name']: item['bytes'] for item in report['objects']},
+            })
+            log(f"{news_count:>8} новостей: {report['file_bytes'] / 1048576:8.2f} МБ, "
+                f"{steps[-1]['bytes_per_news']:8.1f} байт на новость")
+        conn.close()
+    return {'steps': steps}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Бенчмарки RSS-монитора')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Файл для результатов в JSON (по умолчанию stdout)')
+    parser.add_argument('--verbose', action='store_true', help='Не скрывать вывод монитора')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    matcher_parser = subparsers.add_parser('matcher', help='Сравнение способов поиска ключевых слов')
+    matcher_parser.add_argument('--keywords', type=int, default=2000)
+    matcher_parser.add_argument('--entries', type=int, default=200)
+    matcher_parser.add_argument('--words', type=int, default=300, help='Слов в тексте записи')
+    matcher_parser.set_defaults(func=bench_matcher)
+
+    ingest_parser = subparsers.add_parser('ingest', help='Пропускная способность сборщика')
+    ingest_parser.add_argument('--feeds', type=int, default=100)
+    ingest_parser.add_argument('--entries', type=int, default=50, help='Записей в ленте')
+    ingest_parser.add_argument('--words', type=int, default=200, help='Слов в тексте записи')
+    ingest_parser.add_argument('--keywords', type=int, default=500)
+    ingest_parser.add_argument('--latency', type=float, default=0.05, help='Задержка ответа сервера, с')
+    ingest_parser.add_argument('--host-limit', type=int, default=main.FETCH_HOST_LIMIT,
+                               help='Одновременных запросов к хосту (все ленты на одном хосте)')
+    ingest_parser.add_argument('--parse-processes', type=int, default=main.PARSE_PROCESSES)
+    ingest_parser.add_argument('--timeout', type=float, default=300)
+    ingest_parser.set_defaults(func=bench_ingest)
+
+    api_parser = subparsers.add_parser('api', help='Задержка API под нагрузкой')
+    api_parser.add_argument('--news', type=int, default=50000)
+    api_parser.add_argument('--sources', type=int, default=50)
+    api_parser.add_argument('--keywords', type=int, default=200)
+    api_parser.add_argument('--words', type=int, default=100, help='Слов в тексте новости')
+    api_parser.add_argument('--concurrency', type=int, default=8)
+    api_parser.add_argument('--requests', type=int, default=200, help='Запросов на клиента')
+    api_parser.add_argument('--no-cache', action='store_true', help='Отключить кэш ответов')
+    api_parser.set_defaults(func=bench_api)
+
+    growth_parser = subparsers.add_parser('growth', help='Рост размера базы')
+    growth_parser.add_argument('--news', type=int, default=10000)
+    growth_parser.add_argument('--steps', type=int, default=5)
+    growth_parser.add_argument('--sources', type=int, default=50)
+    growth_parser.add_argument('--keywords', type=int, default=200)
+    growth_parser.add_argument('--words', type=int, default=200, help='Слов в тексте новости')
+    growth_parser.set_defaults(func=bench_growth)
+
+    args = parser.parse_args()
+    params = {key: value for key, value in vars(args).items() if key not in ('func', 'output', 'verbose')}
+
+    started = datetime.now()
+    if args.verbose:
+        results = args.func(args)
+    else:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results = args.func(args)
+
+    report = {
+        'scenario': args.scenario,
+        'params': params,
+        'started': started.isoformat(),
+        'python': platform.python_version(),
+        'sqlite': main.sqlite3.sqlite_version,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
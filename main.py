@@ -3,11 +3,45 @@ import feedparser
 import time
 import threading
 import re
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from datetime import datetime
+import io
+import csv
+import sys
+import zlib
+import json
+import base64
+import math
+import queue
+import heapq
+import bisect
+import random
+import html
+import hashlib
+import calendar
+import xml.etree.ElementTree as ElementTree
+import xml.parsers.expat
+import multiprocessing
+import functools
+import http.client
+import http.server
+import socket
+import signal
+import argparse
+import urllib.error
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse, urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, g, has_app_context
+from datetime import datetime, timedelta
+from email.utils import format_datetime
 import os
 from flask_restx import Api, Resource, fields
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 api = Api(app, version='1.0', title='RSS Monitor API',
     description='API для мониторинга RSS-лент и управления ключевыми словами')
@@ -15,7 +49,9 @@ api = Api(app, version='1.0', title='RSS Monitor API',
 news_model = api.model('News', {
     'id': fields.Integer(description='ID новости'),
     'title': fields.String(description='Заголовок новости'),
-    'content': fields.String(description='Содержание новости'),
+    'summary': fields.String(description='Начало текста новости без разметки; null, пока фоновое заполнение '
+                                         'не дошло до новости, сохранённой до его появления'),
+    'thumbnail_url': fields.String(description='URL картинки новости'),
     'url': fields.String(description='URL новости'),
     'published_date': fields.String(description='Дата публикации'),
     'found_date': fields.String(description='Дата обнаружения'),
@@ -23,6 +59,15 @@ news_model = api.model('News', {
     'keywords': fields.List(fields.String, description='Ключевые слова')
 })
 
+news_detail_model = api.inherit('NewsDetail', news_model, {
+    'content': fields.String(description='Полное содержание новости')
+})
+
+news_search_model = api.inherit('NewsSearchResult', news_model, {
+    'snippet': fields.String(description='Фрагмент текста с подсвеченными совпадениями'),
+    'rank': fields.Float(description='Релевантность bm25 (меньше - лучше)')
+})
+
 source_model = api.model('Source', {
     'id': fields.Integer(description='ID источника'),
     'name': fields.String(description='Название источника'),
@@ -36,16 +81,239 @@ keyword_model = api.model('Keyword', {
     'active': fields.Boolean(description='Статус активности')
 })
 
+backfill_model = api.model('KeywordBackfill', {
+    'keyword_id': fields.Integer(description='ID ключевого слова'),
+    'status': fields.String(description='Этап: pending, news, unmatched, done'),
+    'progress': fields.Float(description='Доля пройденных записей текущего этапа'),
+    'scanned': fields.Integer(description='Проверено записей'),
+    'matched': fields.Integer(description='Найдено совпадений'),
+    'created_date': fields.String(description='Дата постановки в очередь'),
+    'updated_date': fields.String(description='Дата последнего обновления')
+})
+
+retention_model = api.model('SourceRetention', {
+    'source_id': fields.Integer(description='ID источника'),
+    'retention_days': fields.Integer(description='Срок хранения новостей в днях (null - общий, 0 - без срока)'),
+    'retention_max_news': fields.Integer(description='Предел числа новостей источника (null или 0 - без предела)')
+})
+
+storage_object_model = api.model('StorageObject', {
+    'name': fields.String(description='Имя таблицы или индекса'),
+    'type': fields.String(description='table или index'),
+    'table': fields.String(description='Таблица, к которой относится объект'),
+    'bytes': fields.Integer(description='Размер в байтах'),
+    'pages': fields.Integer(description='Число страниц')
+})
+
+storage_model = api.model('Storage', {
+    'page_size': fields.Integer(description='Размер страницы'),
+    'page_count': fields.Integer(description='Всего страниц'),
+    'freelist_count': fields.Integer(description='Свободных страниц'),
+    'auto_vacuum': fields.Integer(description='Режим auto_vacuum (2 - инкрементальный)'),
+    'file_bytes': fields.Integer(description='Размер основной базы'),
+    'wal_bytes': fields.Integer(description='Размер журнала WAL'),
+    'objects': fields.List(fields.Nested(storage_object_model), description='Таблицы и индексы'),
+    'archive_bytes': fields.Integer(description='Размер архивной базы'),
+    'archived_news': fields.Integer(description='Новостей в архиве')
+})
+
+retention_run_model = api.model('RetentionRun', {
+    'archived': fields.Integer(description='Перенесено новостей в архив'),
+    'freed_pages': fields.Integer(description='Возвращено страниц')
+})
+
+fetcher_model = api.model('Fetcher', {
+    'id': fields.String(description='Идентификатор процесса сборщика'),
+    'started_date': fields.String(description='Время запуска'),
+    'heartbeat': fields.String(description='Последнее продление аренды'),
+    'sources': fields.Integer(description='Арендовано источников')
+})
+
+timing_model = api.model('Timing', {
+    'p50': fields.Float(description='Медиана, с'),
+    'p95': fields.Float(description='95-й процентиль, с'),
+    'max': fields.Float(description='Максимум, с')
+})
+
+poll_sample_model = api.model('PollSample', {
+    'time': fields.String(description='Время начала опроса'),
+    'status': fields.String(description='HTTP-статус или error'),
+    'error': fields.String(description='Текст ошибки'),
+    'bytes': fields.Integer(description='Загружено байт'),
+    'fetch_seconds': fields.Float(description='Загрузка, с'),
+    'parse_seconds': fields.Float(description='Разбор, с'),
+    'match_seconds': fields.Float(description='Поиск ключевых слов, с'),
+    'write_seconds': fields.Float(description='Запись в БД, с'),
+    'total_seconds': fields.Float(description='Опрос целиком, с'),
+    'entries': fields.Integer(description='Записей в ленте'),
+    'seen': fields.Integer(description='Уже известных записей'),
+    'new': fields.Integer(description='Новых записей'),
+    'matched': fields.Integer(description='Новых записей с ключевыми словами'),
+    'stored': fields.Integer(description='Сохранено новостей'),
+    'duplicates': fields.Integer(description='Связано почти-дубликатов')
+})
+
+hit_bucket_model = api.model('HitBucket', {
+    'bucket': fields.String(description='Начало периода (день или час)'),
+    'hits': fields.Integer(description='Совпадений за период')
+})
+
+hit_rank_model = api.model('HitRank', {
+    'id': fields.Integer(description='ID источника или ключевого слова'),
+    'name': fields.String(description='Название источника или ключевое слово'),
+    'hits': fields.Integer(description='Совпадений за окно')
+})
+
+source_stats_model = api.model('SourceStats', {
+    'source_id': fields.Integer(description='ID источника'),
+    'polls': fields.Integer(description='Опросов в окне наблюдения'),
+    'errors': fields.Integer(description='Из них с ошибкой'),
+    'last_poll': fields.String(description='Время последнего опроса'),
+    'last_status': fields.String(description='Статус последнего опроса'),
+    'last_error': fields.String(description='Последняя ошибка'),
+    'fetch_seconds': fields.Nested(timing_model),
+    'parse_seconds': fields.Nested(timing_model),
+    'match_seconds': fields.Nested(timing_model),
+    'write_seconds': fields.Nested(timing_model),
+    'total_seconds': fields.Nested(timing_model),
+    'bytes': fields.Integer(description='Загружено байт за окно'),
+    'entries': fields.Integer(description='Записей за окно'),
+    'seen': fields.Integer(description='Уже известных записей за окно'),
+    'new': fields.Integer(description='Новых записей за окно'),
+    'matched': fields.Integer(description='Записей с ключевыми словами за окно'),
+    'stored': fields.Integer(description='Сохранено новостей за окно'),
+    'duplicates': fields.Integer(description='Почти-дубликатов за окно'),
+    'recent': fields.List(fields.Nested(poll_sample_model), description='Последние опросы, новые первыми'),
+    'period': fields.String(description='Шаг ряда: hour или day'),
+    'total': fields.Integer(description='Сохранено новостей за окно ряда'),
+    'series': fields.List(fields.Nested(hit_bucket_model), description='Сохранено новостей по периодам'),
+    'top_keywords': fields.List(fields.Nested(hit_rank_model), description='Самые частые ключевые слова за окно')
+})
+
+keyword_stats_model = api.model('KeywordStats', {
+    'keyword_id': fields.Integer(description='ID ключевого слова'),
+    'word': fields.String(description='Ключевое слово'),
+    'period': fields.String(description='Шаг ряда: hour или day'),
+    'total': fields.Integer(description='Совпадений за окно'),
+    'series': fields.List(fields.Nested(hit_bucket_model), description='Совпадения по периодам'),
+    'top_sources': fields.List(fields.Nested(hit_rank_model), description='Источники с наибольшим числом совпадений')
+})
+
+batch_item_model = api.model('BatchItemResult', {
+    'index': fields.Integer(description='Позиция элемента в запросе'),
+    'key': fields.String(description='URL источника или ключевое слово'),
+    'id': fields.Integer(description='ID записи'),
+    'status': fields.String(description='created, updated, unchanged, deleted, not_found или error'),
+    'active': fields.Boolean(description='Статус активности после операции'),
+    'error': fields.String(description='Причина ошибки')
+})
+
+batch_result_model = api.model('BatchResult', {
+    'results': fields.List(fields.Nested(batch_item_model), description='Результат по каждому элементу'),
+    'counts': fields.Raw(description='Число элементов по статусам')
+})
+
 news_ns = api.namespace('news', description='Операции с новостями')
 sources_ns = api.namespace('sources', description='Операции с источниками')
 keywords_ns = api.namespace('keywords', description='Операции с ключевыми словами')
+admin_ns = api.namespace('admin', description='Обслуживание базы данных')
 
 DB_PATH = "rss_monitor.db"
+DB_TIMEOUT = 10
+DB_POOL_SIZE = 8
+DB_CACHE_SIZE = -64000
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_BUSY_RETRIES = 5
+DB_BUSY_BACKOFF = 0.05
+
+def connect_db(check_same_thread=True):
+    # WAL позволяет читателям не блокироваться на время записи сборщика
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT, check_same_thread=check_same_thread)
+    # Действует только для нового файла, до перевода в WAL; существующую
+    # базу переводит команда vacuum (enable_incremental_vacuum)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    return conn
+
+class ConnectionPool:
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = size
+        self.idle = queue.LifoQueue()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            conn = connect_db(check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.idle.qsize() < self.size:
+            self.idle.put(conn)
+        else:
+            conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool():
+    with _pools_lock:
+        if DB_PATH not in _pools:
+            _pools[DB_PATH] = ConnectionPool()
+        return _pools[DB_PATH]
+
+def get_db():
+    # Соединение из пула на время обработки запроса
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def retry_on_busy(func):
+    # Повтор операции записи, если база занята другим писателем дольше DB_TIMEOUT
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_BUSY_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == DB_BUSY_RETRIES - 1:
+                    raise
+                conn = next((arg for arg in args if isinstance(arg, sqlite3.Connection)), None)
+                if conn is None and has_app_context():
+                    conn = g.get('db')
+                if conn is not None and conn.in_transaction:
+                    conn.rollback()
+                time.sleep(DB_BUSY_BACKOFF * 2 ** attempt)
+    return wrapper
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     cursor = conn.cursor()
     
+    # В существующей базе инкрементальный auto_vacuum включается только
+    # полной перестройкой файла под монопольной блокировкой - при запуске
+    # этого не делается, достаточно подсказки
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        print(f"[{datetime.now()}] Инкрементальный auto_vacuum выключен: место после архивирования "
+              f"не возвращается ОС. Включить: python main.py vacuum при остановленных процессах")
+    
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS sources (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -86,89 +354,2423 @@ def init_db():
     )
     ''')
     
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS source_cache (
+        source_id INTEGER PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        FOREIGN KEY (source_id) REFERENCES sources (id)
+    )
+    ''')
+    
     conn.commit()
+    migrate_db(conn)
     conn.close()
 
-def fetch_rss_news():
-    while True:
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id, url FROM sources WHERE active = 1")
-            sources = cursor.fetchall()
-            
-            cursor.execute("SELECT id, word FROM keywords WHERE active = 1")
-            keywords = cursor.fetchall()
-            keyword_patterns = [(keyword_id, re.compile(r'\b' + re.escape(word) + r'\b', re.IGNORECASE)) 
-                               for keyword_id, word in keywords]
-            
-            for source_id, source_url in sources:
-                try:
-                    feed = feedparser.parse(source_url)
-                    
-                    for entry in feed.entries:
-                        title = entry.get('title', '')
-                        content = entry.get('description', '') or entry.get('summary', '')
-                        link = entry.get('link', '')
-                        published = entry.get('published', '') or entry.get('pubDate', '')
-
-                        cursor.execute("SELECT id FROM news WHERE url = ?", (link,))
-                        if cursor.fetchone() is not None:
-                            continue
-                        
-                        matched_keywords = []
-                        for keyword_id, pattern in keyword_patterns:
-                            if pattern.search(title) or pattern.search(content):
-                                matched_keywords.append(keyword_id)
-                        
-                        if matched_keywords:
-                            try:
-                                cursor.execute('''
-                                INSERT INTO news (title, content, url, source_id, published_date, found_date)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                                ''', (title, content, link, source_id, published, datetime.now().isoformat()))
-                                conn.commit()
-
-                                cursor.execute("SELECT id FROM news WHERE url = ?", (link,))
-                                news_id = cursor.fetchone()[0]
-
-                                for keyword_id in matched_keywords:
-                                    cursor.execute('''
-                                    INSERT INTO news_keywords (news_id, keyword_id)
-                                    VALUES (?, ?)
-                                    ''', (news_id, keyword_id))
-                                
-                                conn.commit()
-
-                                cursor.execute("SELECT word FROM keywords WHERE id IN ({})".format(
-                                    ','.join('?' * len(matched_keywords))), matched_keywords)
-                                found_keywords = [row[0] for row in cursor.fetchall()]
-                                
-                                print(f"[{datetime.now()}] НОВАЯ НОВОСТЬ: {title}")
-                                print(f"    URL: {link}")
-                                print(f"    Найдены ключевые слова: {', '.join(found_keywords)}")
-                                print("-" * 80)
-                            except sqlite3.IntegrityError:
-                                pass
-                except Exception as e:
-                    print(f"[{datetime.now()}] Ошибка при обработке источника {source_url}: {e}")
-            
-            conn.close()
-        except Exception as e:
-            print(f"[{datetime.now()}] Ошибка в процессе сбора новостей: {e}")
+def schedule_news_backfill(cursor, job):
+    # Миграции с пересчётом данных по всем новостям только запоминают
+    # диапазон id, а сам пересчёт порциями делает run_news_backfill:
+    # миграция держит блокировку записи и не должна зависеть от размера таблицы
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS app_state (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('''
+    INSERT OR REPLACE INTO app_state (key, value)
+    VALUES (?, 0), (?, (SELECT COALESCE(MAX(id), 0) FROM news))
+    ''', (f'{job}_cursor', f'{job}_until'))
+
+def load_news_backfill(cursor, job):
+    # (последний обработанный id, последний id диапазона)
+    cursor.execute("SELECT key, value FROM app_state WHERE key IN (?, ?)", (f'{job}_cursor', f'{job}_until'))
+    state = dict(cursor.fetchall())
+    return state.get(f'{job}_cursor', 0), state.get(f'{job}_until', 0)
+
+def migrate_news_fingerprints(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS news_simhash (
+        news_id INTEGER PRIMARY KEY,
+        fingerprint INTEGER NOT NULL,
+        band0 INTEGER NOT NULL,
+        band1 INTEGER NOT NULL,
+        band2 INTEGER NOT NULL,
+        band3 INTEGER NOT NULL,
+        FOREIGN KEY (news_id) REFERENCES news (id)
+    )
+    ''')
+    for band in range(SIMHASH_BANDS):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_news_simhash_band{band} ON news_simhash (band{band})")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS news_duplicates (
+        url TEXT PRIMARY KEY,
+        news_id INTEGER NOT NULL,
+        source_id INTEGER,
+        title TEXT,
+        distance INTEGER,
+        found_date TEXT,
+        FOREIGN KEY (news_id) REFERENCES news (id),
+        FOREIGN KEY (source_id) REFERENCES sources (id)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_news_duplicates_news ON news_duplicates (news_id)")
+    
+    # Существующие новости получают канонические URL и отпечатки в фоне
+    schedule_news_backfill(cursor, 'fingerprint')
+
+def migrate_news_summaries(conn):
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE news ADD COLUMN summary TEXT")
+    cursor.execute("ALTER TABLE news ADD COLUMN thumbnail_url TEXT")
+    # Существующие новости заполняются в фоне, до этого summary равно NULL
+    schedule_news_backfill(cursor, 'summary')
+
+# Миграции схемы: номер миграции = её индекс + 1, текущая версия
+# хранится в PRAGMA user_version. Новые миграции добавляются только в конец
+MIGRATIONS = [
+    # 1: индексы для выборок последних новостей и поиска по ключевым словам
+    '''
+    CREATE INDEX IF NOT EXISTS idx_news_found_date ON news (found_date);
+    CREATE INDEX IF NOT EXISTS idx_news_source_found_date ON news (source_id, found_date);
+    CREATE INDEX IF NOT EXISTS idx_news_keywords_keyword ON news_keywords (keyword_id, news_id);
+    CREATE INDEX IF NOT EXISTS idx_keywords_word_nocase ON keywords (word COLLATE NOCASE);
+    ''',
+    # 2: полнотекстовый индекс FTS5 по заголовку и тексту новостей
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(
+        title, content,
+        content='news', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    );
+    CREATE TRIGGER IF NOT EXISTS news_fts_insert AFTER INSERT ON news BEGIN
+        INSERT INTO news_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS news_fts_delete AFTER DELETE ON news BEGIN
+        INSERT INTO news_fts (news_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS news_fts_update AFTER UPDATE OF title, content ON news BEGIN
+        INSERT INTO news_fts (news_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO news_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END;
+    INSERT INTO news_fts (news_fts) VALUES ('rebuild');
+    ''',
+    # 3: окно недавних записей без совпадений и задания дозаполнения
+    '''
+    CREATE TABLE IF NOT EXISTS unmatched_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT,
+        url TEXT NOT NULL UNIQUE,
+        source_id INTEGER,
+        published_date TEXT,
+        seen_date TEXT,
+        FOREIGN KEY (source_id) REFERENCES sources (id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_unmatched_entries_seen_date ON unmatched_entries (seen_date);
+    CREATE TABLE IF NOT EXISTS keyword_backfill (
+        keyword_id INTEGER PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        news_cursor INTEGER DEFAULT 0,
+        unmatched_cursor INTEGER DEFAULT 0,
+        scanned INTEGER DEFAULT 0,
+        matched INTEGER DEFAULT 0,
+        created_date TEXT,
+        updated_date TEXT,
+        FOREIGN KEY (keyword_id) REFERENCES keywords (id)
+    );
+    ''',
+    # 4: отпечатки SimHash, ссылки на почти-дубликаты и канонические URL
+    migrate_news_fingerprints,
+    # 5: собственная политика хранения новостей у источника
+    '''
+    ALTER TABLE sources ADD COLUMN retention_days INTEGER;
+    ALTER TABLE sources ADD COLUMN retention_max_news INTEGER;
+    ''',
+    # 6: аренда источников процессами сборщика и общий счётчик изменений
+    '''
+    CREATE TABLE IF NOT EXISTS fetchers (
+        id TEXT PRIMARY KEY,
+        started_date TEXT,
+        heartbeat REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS source_leases (
+        source_id INTEGER PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires REAL NOT NULL,
+        FOREIGN KEY (source_id) REFERENCES sources (id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_source_leases_owner ON source_leases (owner);
+    CREATE TABLE IF NOT EXISTS app_state (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO app_state (key, value) VALUES ('data_generation', 0);
+    ''',
+    # 7: почасовые и посуточные счётчики совпадений по ключевым словам и источникам
+    '''
+    CREATE TABLE IF NOT EXISTS keyword_hits (
+        keyword_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        hits INTEGER NOT NULL,
+        PRIMARY KEY (keyword_id, period, bucket)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS source_hits (
+        source_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        hits INTEGER NOT NULL,
+        PRIMARY KEY (source_id, period, bucket)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS keyword_source_hits (
+        keyword_id INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        hits INTEGER NOT NULL,
+        PRIMARY KEY (keyword_id, day, source_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_keyword_source_hits_source ON keyword_source_hits (source_id, day);
+    
+    INSERT INTO source_hits (source_id, period, bucket, hits)
+    SELECT source_id, 'day', substr(found_date, 1, 10), COUNT(*)
+    FROM news WHERE source_id IS NOT NULL AND found_date IS NOT NULL
+    GROUP BY 1, 3;
+    INSERT INTO source_hits (source_id, period, bucket, hits)
+    SELECT source_id, 'hour', substr(found_date, 1, 13) || ':00', COUNT(*)
+    FROM news WHERE source_id IS NOT NULL AND found_date IS NOT NULL
+    GROUP BY 1, 3;
+    INSERT INTO keyword_hits (keyword_id, period, bucket, hits)
+    SELECT nk.keyword_id, 'day', substr(n.found_date, 1, 10), COUNT(*)
+    FROM news_keywords nk JOIN news n ON n.id = nk.news_id
+    WHERE n.found_date IS NOT NULL
+    GROUP BY 1, 3;
+    INSERT INTO keyword_hits (keyword_id, period, bucket, hits)
+    SELECT nk.keyword_id, 'hour', substr(n.found_date, 1, 13) || ':00', COUNT(*)
+    FROM news_keywords nk JOIN news n ON n.id = nk.news_id
+    WHERE n.found_date IS NOT NULL
+    GROUP BY 1, 3;
+    INSERT INTO keyword_source_hits (keyword_id, source_id, day, hits)
+    SELECT nk.keyword_id, n.source_id, substr(n.found_date, 1, 10), COUNT(*)
+    FROM news_keywords nk JOIN news n ON n.id = nk.news_id
+    WHERE n.source_id IS NOT NULL AND n.found_date IS NOT NULL
+    GROUP BY 1, 2, 3;
+    ''',
+    # 8: краткое содержание и картинка новости для списков
+    migrate_news_summaries,
+    # 9: URL архивированных новостей, чтобы они не собирались повторно
+    '''
+    CREATE TABLE IF NOT EXISTS archived_urls (
+        url TEXT PRIMARY KEY
+    ) WITHOUT ROWID;
+    ''',
+    # 10: последние опросы источников, сохранённые сборщиком для веб-процессов
+    '''
+    CREATE TABLE IF NOT EXISTS source_poll_stats (
+        source_id INTEGER PRIMARY KEY,
+        samples TEXT NOT NULL,
+        updated_date TEXT NOT NULL
+    );
+    ''',
+]
+
+def split_sql_script(script):
+    # executescript сам фиксирует транзакцию, поэтому скрипт миграции
+    # выполняется по одной инструкции внутри BEGIN IMMEDIATE
+    statements = []
+    current = ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+def migrate_db(conn):
+    # Веб-воркеры и сборщики могут стартовать одновременно: каждая
+    # миграция берёт блокировку записи и заново проверяет версию,
+    # поэтому выполняется ровно одним процессом
+    for number, script in enumerate(MIGRATIONS, start=1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                conn.rollback()
+                continue
+            if callable(script):
+                # Миграции с переносом данных выполняются кодом в одной транзакции
+                script(conn)
+            else:
+                for statement in split_sql_script(script):
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        print(f"[{datetime.now()}] База данных обновлена до версии {number}")
+
+FETCH_INTERVAL = 300
+FETCH_WORKERS = 16
+FETCH_HOST_LIMIT = 4
+FETCH_TIMEOUT = 30
+# Число процессов для разбора лент и поиска ключевых слов; при 0 разбор
+# выполняется в потоках загрузки, а поиск - в потоке записи
+PARSE_PROCESSES = 0
+USER_AGENT = 'RSSMonitor/1.0'
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+def get_host_limit(url):
+    # Ограничение числа одновременных запросов к одному хосту
+    host = urlparse(url).hostname or ''
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(FETCH_HOST_LIMIT)
+        return _host_limits[host]
+
+# Общий HTTP-клиент сборщика: соединения keep-alive переиспользуются
+# между опросами источников одного хоста, ответы запрашиваются сжатыми,
+# постоянные перенаправления запоминаются
+HTTP_POOL_SIZE = FETCH_HOST_LIMIT
+HTTP_IDLE_TIMEOUT = 60
+HTTP_MAX_REDIRECTS = 5
+HTTP_CHUNK_SIZE = 64 * 1024
+# Предел размера ленты после распаковки; лишнее не читается
+HTTP_MAX_BODY = 10 * 1024 * 1024
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli else 'gzip, deflate'
+# Ленты идут от новых записей к старым: загрузка прекращается после
+# стольких подряд уже известных записей. Больше одной - из-за закреплённых
+# записей в начале ленты и ложных срабатываний фильтра Блума
+STREAM_STOP_AFTER_SEEN = 3
+
+class HttpResponse:
+    def __init__(self, client, key, conn, response, url):
+        self.client = client
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = {name.lower(): value for name, value in response.getheaders()}
+        self.complete = False
+
+    def iter_content(self):
+        # Распакованные куски тела не больше HTTP_CHUNK_SIZE каждый, поэтому
+        # сжатая «бомба» не раздувается в памяти целиком
+        encoding = self.headers.get('content-encoding', '').strip().lower()
+        decoder = None
+        if encoding in ('gzip', 'x-gzip'):
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            decoder = zlib.decompressobj()
+        elif encoding == 'br' and brotli:
+            decoder = brotli.Decompressor()
+        elif encoding not in ('', 'identity'):
+            raise ValueError(f"Неподдерживаемое сжатие ответа: {encoding}")
+
+        while True:
+            chunk = self.response.read(HTTP_CHUNK_SIZE)
+            if not chunk:
+                break
+            if decoder is None:
+                yield chunk
+            elif encoding == 'br':
+                yield decoder.process(chunk)
+            else:
+                yield decoder.decompress(chunk, HTTP_CHUNK_SIZE)
+                while decoder.unconsumed_tail:
+                    yield decoder.decompress(decoder.unconsumed_tail, HTTP_CHUNK_SIZE)
+        if decoder is not None and encoding != 'br':
+            yield decoder.flush()
+        self.complete = True
+
+    def close(self):
+        # Соединение возвращается в пул, только если ответ дочитан
+        if self.complete and not self.response.will_close:
+            self.client.release(self.key, self.conn)
+        else:
+            self.conn.close()
+
+class HttpClient:
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=FETCH_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.redirects = {}
+
+    def acquire(self, key):
+        with self.lock:
+            connections = self.idle.get(key)
+            while connections:
+                conn, released = connections.pop()
+                if time.monotonic() - released < HTTP_IDLE_TIMEOUT:
+                    return conn, True
+                conn.close()
+        return self.connect(key), False
+
+    def connect(self, key):
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(host, port, timeout=self.timeout)
+
+    def release(self, key, conn):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.pool_size:
+                connections.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def open(self, url, headers):
+        # Возвращает HttpResponse после всех перенаправлений; вызывающий
+        # обязан закрыть его через close()
+        original_url = url
+        url = self.redirects.get(url, url)
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https') or not parts.hostname:
+                raise ValueError(f"Неподдерживаемый адрес ленты: {url}")
+            key = (parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+            path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+            request_headers = dict(headers, **{'Accept-Encoding': ACCEPT_ENCODING})
+
+            conn, reused = self.acquire(key)
+            try:
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # Сервер закрыл простаивавшее соединение - повтор на новом
+                conn = self.connect(key)
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+
+            result = HttpResponse(self, key, conn, response, url)
+            location = result.headers.get('location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                result.complete = True
+                result.close()
+                target = urljoin(url, location)
+                if response.status in (301, 308):
+                    with self.lock:
+                        self.redirects[original_url] = target
+                url = target
+                continue
+
+            if response.status >= 400 and response.status != 304:
+                conn.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason, result.headers, None)
+            return result
+
+        raise IOError(f"Слишком много перенаправлений: {original_url}")
+
+http_client = HttpClient()
+
+class FeedScanner:
+    # Предварительный проход по ленте потоковым парсером expat: только
+    # ссылки записей, чтобы понять, где начинаются уже известные записи.
+    # Сами записи затем разбирает feedparser по прочитанному префиксу,
+    # обрезанному по концу последней целиком прочитанной записи
+    def __init__(self, is_known):
+        self.is_known = is_known
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.stack = []
+        self.known_run = 0
+        # Вложенность текущей записи и её ссылка
+        self.item_depth = None
+        self.link = None
+        self.link_text = None
+        # Смещение закрывающего тега последней прочитанной записи и
+        # закрывающие теги её незакрытых предков
+        self.item_end = None
+        self.closing = b''
+
+    def feed(self, chunk):
+        # True, если дальше читать ленту не нужно
+        self.parser.Parse(chunk, False)
+        return self.known_run >= STREAM_STOP_AFTER_SEEN
+
+    def start(self, name, attrs):
+        local = name.rsplit(':', 1)[-1]
+        if self.item_depth is None:
+            if local in ('item', 'entry'):
+                self.item_depth = len(self.stack)
+                self.link = None
+        elif len(self.stack) == self.item_depth + 1 and local == 'link' and self.link is None:
+            # <link>URL</link> в RSS или <link rel="alternate" href="URL"/> в Atom
+            href = attrs.get('href')
+            if href is None:
+                # Текст собирается только внутри ссылки записи
+                self.link_text = []
+                self.parser.CharacterDataHandler = self.link_text.append
+            elif attrs.get('rel', 'alternate') == 'alternate':
+                self.link = href.strip()
+        self.stack.append(name)
+
+    def end(self, name):
+        self.stack.pop()
+        if self.link_text is not None and len(self.stack) == self.item_depth + 1:
+            self.parser.CharacterDataHandler = None
+            self.link = ''.join(self.link_text).strip()
+            self.link_text = None
+        if len(self.stack) != self.item_depth or self.known_run >= STREAM_STOP_AFTER_SEEN:
+            return
+        
+        self.item_depth = None
+        if self.link and self.is_known(canonicalize_url(self.link)):
+            self.known_run += 1
+        else:
+            self.known_run = 0
+        self.item_end = self.parser.CurrentByteIndex
+        self.closing = ''.join(f'</{tag}>' for tag in reversed(self.stack)).encode('utf-8')
+
+    def complete_prefix(self, data):
+        # Прочитанное до конца последней целой записи плюс закрывающие теги:
+        # feedparser не должен получить оборванную запись
+        if self.item_end is None:
+            return data
+        return data[:data.index(b'>', self.item_end) + 1] + self.closing
+
+def read_feed_body(response, is_known=None):
+    # Читает тело ответа не больше HTTP_MAX_BODY байт. С is_known чтение
+    # прекращается, как только встретилась серия известных записей
+    scanner = FeedScanner(is_known) if is_known else None
+    chunks = []
+    size = 0
+    for chunk in response.iter_content():
+        chunks.append(chunk[:HTTP_MAX_BODY - size])
+        size += len(chunks[-1])
+        if scanner is not None:
+            try:
+                if scanner.feed(chunks[-1]):
+                    return scanner.complete_prefix(b''.join(chunks))
+            except xml.parsers.expat.ExpatError:
+                # Не строгий XML (например, HTML-сущности) - feedparser
+                # справится сам, но ленту придётся прочитать целиком
+                scanner = None
+        if size >= HTTP_MAX_BODY:
+            print(f"[{datetime.now()}] Лента {response.url} больше {HTTP_MAX_BODY} байт, прочитано начало")
+            data = b''.join(chunks)
+            return scanner.complete_prefix(data) if scanner is not None else data
+    return b''.join(chunks)
+
+def download_feed(url, etag=None, last_modified=None, is_known=None):
+    # Тело уже распаковано, поэтому Content-Encoding дальше не передаётся
+    request_headers = {'User-Agent': USER_AGENT}
+    if etag:
+        request_headers['If-None-Match'] = etag
+    if last_modified:
+        request_headers['If-Modified-Since'] = last_modified
+    
+    with get_host_limit(url):
+        response = http_client.open(url, request_headers)
+        try:
+            if response.status == 304:
+                response.response.read()
+                response.complete = True
+                return 304, b'', {}
+            data = read_feed_body(response, is_known)
+        finally:
+            response.close()
+    
+    headers = {key: value for key, value in response.headers.items()
+               if key not in ('content-encoding', 'content-length', 'transfer-encoding')}
+    headers['content-location'] = response.url
+    return response.status, data, headers
+
+# Краткое содержание для списков: текст без разметки и адрес картинки.
+# Считается при разборе ленты, чтобы главная страница и список API не
+# читали и не отдавали полный content каждой новости
+SUMMARY_LENGTH = 300
+IMG_SRC_PATTERN = re.compile(r'''<img\b[^>]*?\bsrc\s*=\s*["']([^"']+)["']''', re.IGNORECASE)
+
+def make_summary(content):
+    text = ' '.join(html.unescape(re.sub(r'<[^>]+>', ' ', content or '')).split())
+    if len(text) > SUMMARY_LENGTH:
+        text = text[:SUMMARY_LENGTH].rsplit(' ', 1)[0].rstrip(' .,;:-—') + '…'
+    return text
+
+def find_thumbnail(content, entry=None):
+    # media:thumbnail, картинка из media:content или вложения, иначе
+    # первая <img> текста. Только http(s), адрес выводится в атрибут src
+    entry = entry or {}
+    candidates = [media.get('url') for media in entry.get('media_thumbnail', [])]
+    candidates += [media.get('url') for media in entry.get('media_content', [])
+                   if media.get('medium') == 'image' or media.get('type', '').startswith('image/')]
+    candidates += [link.get('href') for link in entry.get('links', [])
+                   if link.get('rel') == 'enclosure' and link.get('type', '').startswith('image/')]
+    match = IMG_SRC_PATTERN.search(content or '')
+    if match:
+        candidates.append(html.unescape(match.group(1)))
+    
+    for url in candidates:
+        if url and urlparse(url.strip()).scheme in ('http', 'https'):
+            return url.strip()
+    return None
+
+def parse_feed(data, headers, matcher=None):
+    # Компактный результат разбора: только нужные поля записей и подсказки
+    # для планировщика. Если передан matcher, keyword_ids заполняются сразу
+    started = time.perf_counter()
+    match_seconds = 0.0
+    feed = feedparser.parse(data, response_headers=headers)
+    entries = []
+    for entry in feed.entries:
+        url = canonicalize_url(entry.get('link', ''))
+        if not url:
+            # Запись без ссылки (в том числе оборванная в конце прочитанной
+            # части ленты) не с чем сопоставить при следующих опросах
+            continue
+        title = entry.get('title', '')
+        content = entry.get('description', '') or entry.get('summary', '')
+        keyword_ids = None
+        if matcher:
+            match_started = time.perf_counter()
+            keyword_ids = matcher.match(title, content)
+            match_seconds += time.perf_counter() - match_started
+        entries.append({
+            'title': title,
+            'content': content,
+            'url': url,
+            'published_date': entry.get('published', '') or entry.get('pubDate', ''),
+            'summary': make_summary(content),
+            'thumbnail_url': find_thumbnail(content, entry),
+            'keyword_ids': keyword_ids,
+        })
+    
+    return {
+        'entries': entries,
+        'interval_hint': feed_interval_hint(feed),
+        'publish_interval': estimate_publish_interval(feed.entries),
+        'parse_seconds': time.perf_counter() - started - match_seconds,
+        'match_seconds': match_seconds,
+    }
+
+_worker_matcher = None
+
+def init_parse_worker(keywords):
+    global _worker_matcher
+    _worker_matcher = build_keyword_matcher(keywords)
+
+def parse_feed_in_worker(data, headers):
+    return parse_feed(data, headers, _worker_matcher)
+
+def create_parse_pool(keywords):
+    # Пул пересоздаётся при изменении ключевых слов: автомат строится один
+    # раз в каждом процессе, а не передаётся с каждой лентой
+    return ProcessPoolExecutor(max_workers=PARSE_PROCESSES, initializer=init_parse_worker,
+                               initargs=(keywords,), mp_context=multiprocessing.get_context('spawn'))
+
+def fetch_source(source_url, cache=None, parse=True, sample=None, is_known=None):
+    # Выполняется в пуле потоков: только сеть и разбор, без обращения к БД.
+    # Возвращает (result, validators); result = None, если лента не
+    # изменилась, иначе разобранная лента или (data, headers) при parse=False.
+    # В sample записываются статус, размер и время загрузки. is_known
+    # позволяет не дочитывать ленту после уже известных записей
+    etag, last_modified, content_hash = cache or (None, None, None)
+    started = time.perf_counter()
+    status, data, headers = download_feed(source_url, etag, last_modified, is_known)
+    if sample is not None:
+        sample.update(status=status, bytes=len(data), fetch_seconds=time.perf_counter() - started)
+    if status == 304:
+        return None, cache
+    
+    new_hash = hashlib.sha256(data).hexdigest()
+    validators = (headers.get('etag'), headers.get('last-modified'), new_hash)
+    if new_hash == content_hash:
+        return None, validators
+    
+    if not parse:
+        return (data, headers), validators
+    return parse_feed(data, headers), validators
+
+def load_source_cache(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT source_id, etag, last_modified, content_hash FROM source_cache")
+    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+@retry_on_busy
+def save_source_cache(conn, source_id, validators):
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT OR REPLACE INTO source_cache (source_id, etag, last_modified, content_hash)
+    VALUES (?, ?, ?, ?)
+    ''', (source_id, *validators))
+    conn.commit()
+
+MATCHER_BACKEND = 'aho_corasick'
+
+def is_word_char(ch):
+    # Совпадает с определением \w в регулярных выражениях Python для str
+    return ch.isalnum() or ch == '_'
+
+def fold_case(text):
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    # Редкие символы при lower() меняют длину, смещая позиции совпадений
+    return ''.join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+
+class RegexKeywordMatcher:
+    # Отдельное регулярное выражение \bслово\b на каждое ключевое слово
+    def __init__(self, keywords):
+        self.patterns = [(keyword_id, re.compile(r'\b' + re.escape(word) + r'\b', re.IGNORECASE))
+                         for keyword_id, word in keywords]
+
+    def match(self, *texts):
+        return [keyword_id for keyword_id, pattern in self.patterns
+                if any(pattern.search(text) for text in texts)]
+
+class AhoCorasickKeywordMatcher:
+    # Автомат Ахо-Корасик: один проход по тексту для всех ключевых слов.
+    # Границы слов проверяются так же, как \b в RegexKeywordMatcher
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        
+        for keyword_id, word in keywords:
+            word = fold_case(word)
+            if not word:
+                continue
+            state = 0
+            for ch in word:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][ch] = next_state
+                state = next_state
+            self.output[state].append((keyword_id, len(word), is_word_char(word[0]), is_word_char(word[-1])))
+        
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+                queue.append(next_state)
+
+    def match(self, *texts):
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        
+        for text in texts:
+            text = fold_case(text)
+            length = len(text)
+            state = 0
+            for i, ch in enumerate(text):
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(ch, 0)
+                if not output[state]:
+                    continue
+                for keyword_id, word_length, starts_word, ends_word in output[state]:
+                    if keyword_id in found:
+                        continue
+                    start = i - word_length + 1
+                    word_before = start > 0 and is_word_char(text[start - 1])
+                    word_after = i + 1 < length and is_word_char(text[i + 1])
+                    if word_before != starts_word and word_after != ends_word:
+                        found.add(keyword_id)
+        
+        return sorted(found)
+
+MATCHER_BACKENDS = {
+    'regex': RegexKeywordMatcher,
+    'aho_corasick': AhoCorasickKeywordMatcher,
+}
+
+def build_keyword_matcher(keywords, backend=None):
+    return MATCHER_BACKENDS[backend or MATCHER_BACKEND](keywords)
+
+# Параметры запроса, которые не меняют содержимое страницы
+TRACKING_PARAMS = {'fbclid', 'gclid', 'yclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', '_openstat'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def canonicalize_url(url):
+    # Один и тот же материал часто приходит с разными utm-метками,
+    # якорями и завершающим слешем - приводим адрес к одному виду
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.hostname:
+        return url
+    
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname.lower()
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc += f':{port}'
+    if parts.username:
+        userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+        netloc = f'{userinfo}@{netloc}'
+    
+    path = parts.path.rstrip('/') or '/'
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS]
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+# Почти-дубликатом считается новость с отпечатком, отличающимся не более
+# чем в SIMHASH_MAX_DISTANCE битах. При 4 полосах по 16 бит у таких
+# отпечатков хотя бы одна полоса отличается не более чем одним битом,
+# поэтому кандидаты ищутся по индексам полос (значение и его соседи на
+# расстоянии одного бита), а не перебором всех новостей. Порог 7, а не 3:
+# в описаниях RSS из ~40 слов одно добавленное слово или подпись
+# источника меняет заметную долю признаков и чаще сдвигает 4-6 бит
+SIMHASH_MAX_DISTANCE = 7
+# Слишком короткие тексты не получают отпечаток, иначе совпадают случайно
+SIMHASH_MIN_FEATURES = 8
+
+def text_features(title, content):
+    # Признаки для SimHash - пары соседних слов текста без разметки
+    text = html.unescape(re.sub(r'<[^>]+>', ' ', f'{title} {content or ""}'))
+    tokens = re.findall(r'\w+', text.lower())
+    return [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+
+# Биты хэша признака раскладываются по 16-битным ячейкам одного большого
+# целого (по таблице на каждый байт хэша). Сумма таких чисел даёт в каждой
+# ячейке число признаков с единицей в этом бите - без цикла по 64 битам
+# на каждый признак
+SIMHASH_LANE_BITS = 16
+SIMHASH_LANE_MASK = (1 << SIMHASH_LANE_BITS) - 1
+SIMHASH_SPREAD = [[sum(1 << (position * 8 + bit) * SIMHASH_LANE_BITS for bit in range(8) if byte >> bit & 1)
+                   for byte in range(256)]
+                  for position in range(SIMHASH_BITS // 8)]
+
+def simhash(features):
+    set_counts = [0] * SIMHASH_BITS
+    total = 0
+    lanes = 0
+    pending = 0
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        for position, byte in enumerate(digest):
+            lanes += SIMHASH_SPREAD[position][byte]
+        pending += 1
+        # Ячейки сбрасываются до переполнения
+        if pending == SIMHASH_LANE_MASK:
+            for bit in range(SIMHASH_BITS):
+                set_counts[bit] += lanes >> bit * SIMHASH_LANE_BITS & SIMHASH_LANE_MASK
+            total += pending
+            lanes = pending = 0
+    for bit in range(SIMHASH_BITS):
+        set_counts[bit] += lanes >> bit * SIMHASH_LANE_BITS & SIMHASH_LANE_MASK
+    total += pending
+    # Бит отпечатка - большинство голосов признаков, ничья даёт 0
+    return sum(1 << bit for bit, count in enumerate(set_counts) if count * 2 > total)
+
+def news_fingerprint(title, content):
+    features = text_features(title, content)
+    if len(features) < SIMHASH_MIN_FEATURES:
+        return None
+    return simhash(features)
+
+def simhash_bands(fingerprint):
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [fingerprint >> (band * width) & mask for band in range(SIMHASH_BANDS)]
+
+def store_news_fingerprint(cursor, news_id, fingerprint):
+    if fingerprint is None:
+        return
+    # INTEGER в SQLite знаковый, поэтому старший бит переносим в знак
+    signed = fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+    cursor.execute('''
+    INSERT OR REPLACE INTO news_simhash (news_id, fingerprint, band0, band1, band2, band3)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', (news_id, signed, *simhash_bands(fingerprint)))
+
+def simhash_band_probes(band):
+    # Значение полосы и все значения, отличающиеся от него одним битом
+    return [band] + [band ^ 1 << bit for bit in range(SIMHASH_BITS // SIMHASH_BANDS)]
+
+def find_near_duplicate(cursor, fingerprint):
+    # Возвращает (news_id, distance) ближайшей сохранённой новости или None
+    probes = [simhash_band_probes(band) for band in simhash_bands(fingerprint)]
+    placeholders = ', '.join('?' * len(probes[0]))
+    conditions = ' OR '.join(f'band{band} IN ({placeholders})' for band in range(SIMHASH_BANDS))
+    cursor.execute(f'''
+    SELECT news_id, fingerprint FROM news_simhash
+    WHERE {conditions}
+    ''', [value for band in probes for value in band])
+    best = None
+    for news_id, candidate in cursor.fetchall():
+        distance = bin((candidate & (1 << 64) - 1) ^ fingerprint).count('1')
+        if distance <= SIMHASH_MAX_DISTANCE and (best is None or distance < best[1]):
+            best = (news_id, distance)
+    return best
+
+SEEN_URLS_CAPACITY = 100000
+SEEN_URLS_ERROR_RATE = 0.01
+SEEN_URLS_LRU_SIZE = 10000
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class SeenUrlIndex:
+    # Фильтр Блума по всем URL из news, news_duplicates, unmatched_entries
+    # и archived_urls и LRU недавно встреченных адресов.
+    # Отрицательный ответ фильтра точен, поэтому SQLite проверяется только
+    # для адресов, которые фильтр считает возможно известными, но нет в LRU
+    def __init__(self, capacity=SEEN_URLS_CAPACITY, lru_size=SEEN_URLS_LRU_SIZE):
+        self.capacity = capacity
+        self.lru_size = lru_size
+        self.bloom = BloomFilter(capacity, SEEN_URLS_ERROR_RATE)
+        self.recent = OrderedDict()
+        self.db_lookups = 0
+        self.false_positives = 0
+
+    @property
+    def needs_rebuild(self):
+        return self.bloom.count > self.bloom.capacity
+
+    def warm(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT (SELECT COUNT(*) FROM news) + (SELECT COUNT(*) FROM news_duplicates)
+             + (SELECT COUNT(*) FROM unmatched_entries) + (SELECT COUNT(*) FROM archived_urls)
+        ''')
+        total = cursor.fetchone()[0]
+        
+        self.bloom = BloomFilter(max(self.capacity, total * 2), SEEN_URLS_ERROR_RATE)
+        self.recent = OrderedDict()
+        # Архивные адреса, дубликаты и записи без совпадений раньше новостей,
+        # чтобы в LRU остались последние новости
+        cursor.execute("SELECT url FROM archived_urls")
+        for (url,) in cursor:
+            self.bloom.add(url)
+        cursor.execute("SELECT url FROM news_duplicates UNION ALL SELECT url FROM unmatched_entries")
+        for (url,) in cursor.fetchall():
+            self.add(url)
+        cursor.execute("SELECT url FROM news ORDER BY id")
+        for (url,) in cursor:
+            self.add(url)
+        
+        stats = self.stats()
+        print(f"[{datetime.now()}] Индекс URL: {stats['urls']} адресов, "
+              f"фильтр {stats['bloom_bytes'] // 1024} КБ, LRU {stats['lru_size']} адресов "
+              f"(~{stats['memory_bytes'] // 1024} КБ всего)")
+
+    def add(self, url):
+        self.bloom.add(url)
+        self._remember(url)
+
+    def _remember(self, url):
+        self.recent[url] = True
+        self.recent.move_to_end(url)
+        if len(self.recent) > self.lru_size:
+            self.recent.popitem(last=False)
+
+    def is_seen(self, cursor, url):
+        if url not in self.bloom:
+            return False
+        if url in self.recent:
+            self.recent.move_to_end(url)
+            return True
+        
+        self.db_lookups += 1
+        cursor.execute('''
+        SELECT 1 FROM news WHERE url = ?
+        UNION ALL
+        SELECT 1 FROM news_duplicates WHERE url = ?
+        UNION ALL
+        SELECT 1 FROM unmatched_entries WHERE url = ?
+        UNION ALL
+        SELECT 1 FROM archived_urls WHERE url = ?
+        LIMIT 1
+        ''', (url, url, url, url))
+        if cursor.fetchone() is None:
+            self.false_positives += 1
+            return False
+        self._remember(url)
+        return True
+
+    def might_be_seen(self, url):
+        # Только фильтр Блума: безопасно вызывать из потоков загрузки
+        return url in self.bloom
+
+    def stats(self):
+        lru_bytes = sys.getsizeof(self.recent) + sum(sys.getsizeof(url) for url in self.recent)
+        return {
+            'urls': self.bloom.count,
+            'bloom_bytes': len(self.bloom.bits),
+            'bloom_hashes': self.bloom.hash_count,
+            'lru_size': len(self.recent),
+            'memory_bytes': len(self.bloom.bits) + lru_bytes,
+            'db_lookups': self.db_lookups,
+            'false_positives': self.false_positives,
+        }
+
+def collect_new_entries(conn, source_id, entries, matcher, seen_index, sample=None):
+    # Возвращает (items, unmatched): новые записи с совпадениями и без них.
+    # Записи без совпадений хранятся некоторое время для дозаполнения
+    # по новым ключевым словам
+    cursor = conn.cursor()
+    items = []
+    unmatched = []
+    seen_urls = set()
+    match_seconds = 0.0
+
+    for entry in entries:
+        link = entry['url']
+        if link in seen_urls:
+            continue
+        if seen_index.is_seen(cursor, link):
+            continue
+        
+        matched_keywords = entry['keyword_ids']
+        if matched_keywords is None:
+            match_started = time.perf_counter()
+            matched_keywords = matcher.match(entry['title'], entry['content'])
+            match_seconds += time.perf_counter() - match_started
+        seen_urls.add(link)
+        item = dict(entry, source_id=source_id, found_date=datetime.now().isoformat(),
+                    keyword_ids=matched_keywords)
+        
+        if matched_keywords:
+            items.append(item)
+        else:
+            unmatched.append(item)
+    
+    if sample is not None:
+        sample.update(entries=len(entries), seen=len(entries) - len(items) - len(unmatched),
+                      new=len(items) + len(unmatched), matched=len(items))
+        sample['match_seconds'] = (sample.get('match_seconds') or 0) + match_seconds
+    return items, unmatched
+
+@retry_on_busy
+def save_unmatched_entries(conn, unmatched):
+    if not unmatched:
+        return
+    
+    with conn:
+        conn.executemany('''
+        INSERT OR IGNORE INTO unmatched_entries (title, content, url, source_id, published_date, seen_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(item['title'], item['content'], item['url'], item['source_id'],
+               item['published_date'], item['found_date']) for item in unmatched])
+
+# Счётчики совпадений для графиков: сколько новостей сохранено по
+# источнику и сколько совпадений у ключевого слова за час и за сутки.
+# Пишутся в транзакции самих новостей и переживают архивирование
+STATS_PERIODS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+def stats_bucket(found_date, period):
+    # Начало периода в том же формате ISO, что и found_date
+    return found_date[:10] if period == 'day' else found_date[:13] + ':00'
+
+def record_hits(cursor, news, links):
+    # news - [(source_id, found_date)] сохранённых новостей,
+    # links - [(keyword_id, source_id, found_date)] новых связей с ключевыми словами
+    source_hits = Counter()
+    keyword_hits = Counter()
+    keyword_source_hits = Counter()
+    for source_id, found_date in news:
+        for period in STATS_PERIODS:
+            source_hits[source_id, period, stats_bucket(found_date, period)] += 1
+    for keyword_id, source_id, found_date in links:
+        for period in STATS_PERIODS:
+            keyword_hits[keyword_id, period, stats_bucket(found_date, period)] += 1
+        keyword_source_hits[keyword_id, source_id, stats_bucket(found_date, 'day')] += 1
+    
+    cursor.executemany('''
+    INSERT INTO source_hits (source_id, period, bucket, hits) VALUES (?, ?, ?, ?)
+    ON CONFLICT (source_id, period, bucket) DO UPDATE SET hits = hits + excluded.hits
+    ''', [(*key, hits) for key, hits in source_hits.items()])
+    cursor.executemany('''
+    INSERT INTO keyword_hits (keyword_id, period, bucket, hits) VALUES (?, ?, ?, ?)
+    ON CONFLICT (keyword_id, period, bucket) DO UPDATE SET hits = hits + excluded.hits
+    ''', [(*key, hits) for key, hits in keyword_hits.items()])
+    cursor.executemany('''
+    INSERT INTO keyword_source_hits (keyword_id, source_id, day, hits) VALUES (?, ?, ?, ?)
+    ON CONFLICT (keyword_id, day, source_id) DO UPDATE SET hits = hits + excluded.hits
+    ''', [(*key, hits) for key, hits in keyword_source_hits.items()])
+
+@retry_on_busy
+def write_news_batch(conn, items, keyword_names):
+    # Вся пачка новостей записывается одной транзакцией
+    if not items:
+        return []
+    
+    cursor = conn.cursor()
+    # (элемент, id новости) и (элемент, id оригинала) этой попытки: поля
+    # элементов заполняются только после фиксации, чтобы повтор после
+    # SQLITE_BUSY (retry_on_busy) не видел следов откаченной попытки
+    stored = []
+    duplicates = []
+    # (news_id, keyword_id, source_id, found_date): источник и дата - той
+    # новости, к которой привязывается ключевое слово
+    news_keywords = []
+    
+    with conn:
+        for item in items:
+            cursor.execute('''
+            SELECT 1 FROM news WHERE url = ?
+            UNION ALL
+            SELECT 1 FROM archived_urls WHERE url = ?
+            ''', (item['url'], item['url']))
+            if cursor.fetchone() is not None:
+                continue
+            
+            # Перепечатка уже сохранённого материала только связывается с
+            # оригиналом: текст не хранится, ключевые слова переносятся
+            fingerprint = news_fingerprint(item['title'], item['content'])
+            duplicate = find_near_duplicate(cursor, fingerprint) if fingerprint is not None else None
+            if duplicate is not None:
+                original_id, distance = duplicate
+                cursor.execute('''
+                INSERT OR IGNORE INTO news_duplicates (url, news_id, source_id, title, distance, found_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', (item['url'], original_id, item['source_id'], item['title'], distance, item['found_date']))
+                cursor.execute("SELECT source_id, found_date FROM news WHERE id = ?", (original_id,))
+                original = cursor.fetchone()
+                news_keywords.extend((original_id, keyword_id, *original) for keyword_id in item['keyword_ids'])
+                duplicates.append((item, original_id))
+                continue
+            
+            cursor.execute('''
+            INSERT OR IGNORE INTO news
+                (title, content, summary, thumbnail_url, url, source_id, published_date, found_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (item['title'], item['content'], item['summary'], item['thumbnail_url'], item['url'],
+                  item['source_id'], item['published_date'], item['found_date']))
+            # Проверка URL выше идёт до начала транзакции записи: тот же URL
+            # мог успеть сохранить другой писатель (дозаполнение, другой
+            # сборщик). Тогда вставка пропущена и lastrowid не относится к ней
+            if cursor.rowcount == 0:
+                continue
+            news_id = cursor.lastrowid
+            store_news_fingerprint(cursor, news_id, fingerprint)
+            news_keywords.extend((news_id, keyword_id, item['source_id'], item['found_date'])
+                                 for keyword_id in item['keyword_ids'])
+            stored.append((item, news_id))
+        
+        # Счётчики совпадений считают связи новость - ключевое слово, как и
+        # миграция 7: связь, перенесённая с перепечатки на оригинал, учитывается
+        # у оригинала (его источник и дата), уже существовавшая - нет.
+        # Сама перепечатка новостью источника не считается
+        links = []
+        for news_id, keyword_id, source_id, found_date in news_keywords:
+            cursor.execute("INSERT OR IGNORE INTO news_keywords (news_id, keyword_id) VALUES (?, ?)",
+                           (news_id, keyword_id))
+            if cursor.rowcount and source_id is not None and found_date:
+                links.append((keyword_id, source_id, found_date))
+        cursor.executemany("DELETE FROM unmatched_entries WHERE url = ?",
+                           [(item['url'],) for item in items])
+        record_hits(cursor, [(item['source_id'], item['found_date']) for item, _ in stored], links)
+    
+    for item, original_id in duplicates:
+        item['duplicate_of'] = original_id
+        print(f"[{datetime.now()}] ДУБЛИКАТ новости {original_id}: {item['title']}")
+        print(f"    URL: {item['url']}")
+    
+    for item, news_id in stored:
+        item['id'] = news_id
+    stored = [item for item, _ in stored]
+    
+    for item in stored:
+        item['keywords'] = [keyword_names[keyword_id] for keyword_id in item['keyword_ids']]
+        print(f"[{datetime.now()}] НОВАЯ НОВОСТЬ: {item['title']}")
+        print(f"    URL: {item['url']}")
+        print(f"    Найдены ключевые слова: {', '.join(item['keywords'])}")
+        print("-" * 80)
+    
+    return stored
+
+STREAM_QUEUE_SIZE = 256
+STREAM_HEARTBEAT = 15
+STREAM_REPLAY_LIMIT = 500
+STREAM_POLL_INTERVAL = 2
+STREAM_EVENT_FIELDS = ['id', 'title', 'url', 'source_id', 'published_date', 'found_date', 'keywords']
+
+class NewsSubscription:
+    def __init__(self, keyword_ids=None, source_ids=None, queue_size=STREAM_QUEUE_SIZE):
+        self.keyword_ids = set(keyword_ids or ())
+        self.source_ids = set(source_ids or ())
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lagging = False
+
+    def accepts(self, item):
+        if self.source_ids and item['source_id'] not in self.source_ids:
+            return False
+        if self.keyword_ids and self.keyword_ids.isdisjoint(item['keyword_ids']):
+            return False
+        return True
+
+def load_new_news(conn, after_id, limit=STREAM_REPLAY_LIMIT):
+    # Новости с id больше after_id в том виде, в каком их публикует сборщик.
+    # Запись в SQLite идёт по одной транзакции, поэтому id фиксируются по
+    # возрастанию и выборка по id > after_id ничего не пропускает
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT id, title, url, source_id, published_date, found_date
+    FROM news
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+    ''', (after_id, limit))
+    items = {row['id']: dict(row, keyword_ids=[], keywords=[]) for row in cursor.fetchall()}
+    if not items:
+        return []
+    
+    cursor.execute('''
+    SELECT nk.news_id, k.id, k.word
+    FROM news_keywords nk
+    JOIN keywords k ON k.id = nk.keyword_id
+    WHERE nk.news_id IN ({})
+    ORDER BY nk.news_id, nk.keyword_id
+    '''.format(','.join('?' * len(items))), list(items))
+    for news_id, keyword_id, word in cursor.fetchall():
+        items[news_id]['keyword_ids'].append(keyword_id)
+        items[news_id]['keywords'].append(word)
+    return list(items.values())
+
+class NewsBus:
+    # Рассылка новых новостей подписчикам внутри процесса. Очереди
+    # подписчиков ограничены: медленный клиент не задерживает сборщик,
+    # а пропущенные события потом догружает из БД.
+    # При poll_db новости публикует фоновый поток, который опрашивает БД,
+    # пока есть хотя бы один подписчик: так приходят и новости, сохранённые
+    # другими процессами
+    def __init__(self, poll_db=True):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.poll_db = poll_db
+        self.poller = None
+
+    def subscribe(self, keyword_ids=None, source_ids=None):
+        subscription = NewsSubscription(keyword_ids, source_ids)
+        with self.lock:
+            self.subscribers.add(subscription)
+            if self.poll_db and self.poller is None:
+                # Начальная позиция читается до того, как подписчик запомнит
+                # свою, иначе новость между двумя чтениями потерялась бы
+                conn = connect_db(check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM news").fetchone()[0]
+                self.poller = threading.Thread(target=self.poll_news, args=(conn, last_id),
+                                               name='news-poller', daemon=True)
+                self.poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, items):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            for item in items:
+                if not subscription.accepts(item):
+                    continue
+                try:
+                    subscription.queue.put_nowait({field: item[field] for field in STREAM_EVENT_FIELDS})
+                except queue.Full:
+                    subscription.lagging = True
+                    break
+
+    def publish_local(self, items):
+        # Новости, сохранённые в этом процессе; при poll_db их доставит
+        # опрос БД, и повторная публикация дала бы дубликаты событий
+        if not self.poll_db:
+            self.publish(items)
+
+    def poll_news(self, conn, last_id):
+        try:
+            while True:
+                with self.lock:
+                    if not self.subscribers:
+                        self.poller = None
+                        return
+                try:
+                    items = load_new_news(conn, last_id)
+                except sqlite3.Error as e:
+                    print(f"[{datetime.now()}] Ошибка чтения новых новостей для потока: {e}")
+                    items = []
+                if items:
+                    self.publish(items)
+                    last_id = items[-1]['id']
+                if len(items) < STREAM_REPLAY_LIMIT:
+                    time.sleep(STREAM_POLL_INTERVAL)
+        finally:
+            conn.close()
+
+news_bus = NewsBus()
+
+POLL_MIN_INTERVAL = 60
+POLL_MAX_INTERVAL = 6 * 3600
+POLL_RATE_FACTOR = 0.5
+POLL_BACKOFF_FACTOR = 1.5
+POLL_JITTER = 0.1
+SCHEDULER_SYNC_INTERVAL = 30
+
+UPDATE_PERIODS = {
+    'hourly': 3600,
+    'daily': 86400,
+    'weekly': 7 * 86400,
+    'monthly': 30 * 86400,
+    'yearly': 365 * 86400,
+}
+
+def feed_interval_hint(feed):
+    # Минимальный интервал опроса из <ttl> (минуты) или sy:updatePeriod
+    hints = []
+    try:
+        ttl = int(feed.feed.get('ttl', 0))
+        if ttl > 0:
+            hints.append(ttl * 60)
+    except (TypeError, ValueError):
+        pass
+    
+    period = UPDATE_PERIODS.get(str(feed.feed.get('sy_updateperiod', '')).strip().lower())
+    if period:
+        try:
+            frequency = max(1, int(feed.feed.get('sy_updatefrequency', 1)))
+        except (TypeError, ValueError):
+            frequency = 1
+        hints.append(period / frequency)
+    
+    return min(hints) if hints else None
+
+def estimate_publish_interval(entries, now=None):
+    # Средний интервал между публикациями за период, который покрывает лента
+    now = now or time.time()
+    times = []
+    for entry in entries:
+        parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+        if parsed:
+            times.append(min(calendar.timegm(parsed), now))
+    if not times:
+        return None
+    return max(now - min(times), 1) / len(times)
+
+class PollScheduler:
+    # Очередь с приоритетом по времени следующего опроса каждого источника
+    def __init__(self, default_interval=FETCH_INTERVAL):
+        self.default_interval = default_interval
+        self.sources = {}
+        self.queue = []
+
+    def _push(self, source_id, delay):
+        state = self.sources[source_id]
+        state['next_poll'] = time.time() + delay
+        heapq.heappush(self.queue, (state['next_poll'], source_id))
+
+    def sync(self, sources):
+        active = dict(sources)
+        for source_id in list(self.sources):
+            if source_id not in active:
+                del self.sources[source_id]
+        for source_id, url in active.items():
+            if source_id in self.sources:
+                self.sources[source_id]['url'] = url
+                continue
+            self.sources[source_id] = {'url': url, 'interval': self.default_interval,
+                                       'errors': 0, 'next_poll': None}
+            # Новые источники опрашиваются сразу, с небольшим разбросом
+            self._push(source_id, random.uniform(0, POLL_MIN_INTERVAL * POLL_JITTER))
+
+    def due(self, limit):
+        now = time.time()
+        result = []
+        while self.queue and len(result) < limit and self.queue[0][0] <= now:
+            next_poll, source_id = heapq.heappop(self.queue)
+            state = self.sources.get(source_id)
+            if state is None or state['next_poll'] != next_poll:
+                continue
+            state['next_poll'] = None
+            result.append((source_id, state['url']))
+        return result
+
+    def seconds_until_next(self):
+        while self.queue:
+            next_poll, source_id = self.queue[0]
+            state = self.sources.get(source_id)
+            if state is not None and state['next_poll'] == next_poll:
+                return max(0, next_poll - time.time())
+            heapq.heappop(self.queue)
+        return None
+
+    def _clamp(self, interval):
+        return min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+
+    def _push_jittered(self, source_id, interval):
+        self._push(source_id, interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER))
+
+    def record_success(self, source_id, parsed):
+        state = self.sources.get(source_id)
+        if state is None:
+            return
+        interval = state['interval']
+        if parsed['publish_interval']:
+            interval = parsed['publish_interval'] * POLL_RATE_FACTOR
+        hint = parsed['interval_hint']
+        if hint:
+            interval = max(interval, min(hint, POLL_MAX_INTERVAL))
+        state['interval'] = self._clamp(interval)
+        state['errors'] = 0
+        self._push_jittered(source_id, state['interval'])
+
+    def record_not_modified(self, source_id):
+        state = self.sources.get(source_id)
+        if state is None:
+            return
+        state['interval'] = self._clamp(state['interval'] * POLL_BACKOFF_FACTOR)
+        state['errors'] = 0
+        self._push_jittered(source_id, state['interval'])
+
+    def record_error(self, source_id):
+        state = self.sources.get(source_id)
+        if state is None:
+            return
+        state['errors'] += 1
+        self._push_jittered(source_id, self._clamp(state['interval'] * 2 ** state['errors']))
+
+# Распределение источников между процессами сборщика. Каждый сборщик
+# держит аренду на свою долю активных источников и продлевает её при
+# синхронизации расписания. Аренда остановленного или зависшего процесса
+# истекает через SOURCE_LEASE_TTL, и его источники забирают остальные
+SOURCE_LEASE_TTL = 4 * SCHEDULER_SYNC_INTERVAL
+
+def make_fetcher_id():
+    return f'{socket.gethostname()}-{os.getpid()}-{random.getrandbits(32):08x}'
+
+@retry_on_busy
+def claim_sources(conn, owner):
+    # Продлевает аренду своих источников и добирает свободные до равной
+    # доли на каждого живого сборщика; лишние при появлении нового
+    # сборщика отпускаются. BEGIN IMMEDIATE не даёт двум процессам
+    # захватить один источник. Возвращает [(source_id, url)] своих источников
+    now = time.time()
+    expires = now + SOURCE_LEASE_TTL
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute('''
+        INSERT INTO fetchers (id, started_date, heartbeat) VALUES (?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET heartbeat = excluded.heartbeat
+        ''', (owner, datetime.now().isoformat(), now))
+        cursor.execute("DELETE FROM fetchers WHERE heartbeat < ?", (now - SOURCE_LEASE_TTL,))
+        cursor.execute('''
+        DELETE FROM source_leases
+        WHERE expires < ? OR source_id NOT IN (SELECT id FROM sources WHERE active = 1)
+        ''', (now,))
+        
+        cursor.execute("SELECT COUNT(*) FROM fetchers")
+        fetchers = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM sources WHERE active = 1")
+        share = math.ceil(cursor.fetchone()[0] / fetchers)
+        
+        cursor.execute("UPDATE source_leases SET expires = ? WHERE owner = ?", (expires, owner))
+        cursor.execute("SELECT source_id FROM source_leases WHERE owner = ? ORDER BY source_id", (owner,))
+        owned = [row[0] for row in cursor.fetchall()]
+        if len(owned) > share:
+            # Источник, загрузка которого ещё идёт, новый владелец может
+            # опросить повторно - это один лишний запрос, дубликатов не будет
+            cursor.executemany("DELETE FROM source_leases WHERE source_id = ?",
+                               [(source_id,) for source_id in owned[share:]])
+        elif len(owned) < share:
+            cursor.execute('''
+            INSERT INTO source_leases (source_id, owner, expires)
+            SELECT s.id, ?, ? FROM sources s
+            WHERE s.active = 1 AND s.id NOT IN (SELECT source_id FROM source_leases)
+            ORDER BY s.id
+            LIMIT ?
+            ''', (owner, expires, share - len(owned)))
+        
+        cursor.execute('''
+        SELECT s.id, s.url FROM source_leases l
+        JOIN sources s ON s.id = l.source_id
+        WHERE l.owner = ?
+        ''', (owner,))
+        claimed = cursor.fetchall()
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return claimed
+
+def release_sources(conn, owner):
+    # При штатной остановке источники освобождаются сразу, не дожидаясь
+    # истечения аренды
+    with conn:
+        conn.execute("DELETE FROM source_leases WHERE owner = ?", (owner,))
+        conn.execute("DELETE FROM fetchers WHERE id = ?", (owner,))
+
+# Метрики сборщика: по каждому источнику хранится кольцевой буфер
+# последних опросов и накопительные гистограммы/счётчики для /metrics
+METRICS_HISTORY = 100
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_TIMINGS = {
+    'fetch_seconds': ('rss_fetch_duration_seconds', 'Время загрузки ленты'),
+    'parse_seconds': ('rss_parse_duration_seconds', 'Время разбора ленты'),
+    'match_seconds': ('rss_match_duration_seconds', 'Время поиска ключевых слов'),
+    'write_seconds': ('rss_write_duration_seconds', 'Время записи новостей в БД'),
+    'total_seconds': ('rss_poll_duration_seconds', 'Полное время опроса: от постановки в очередь до записи'),
+}
+METRICS_COUNTERS = {
+    'bytes': ('rss_fetch_bytes_total', 'Загружено байт'),
+    'entries': ('rss_entries_total', 'Записей в лентах'),
+    'seen': ('rss_entries_seen_total', 'Уже известных записей'),
+    'new': ('rss_entries_new_total', 'Новых записей'),
+    'matched': ('rss_entries_matched_total', 'Новых записей с ключевыми словами'),
+    'stored': ('rss_news_stored_total', 'Сохранено новостей'),
+    'duplicates': ('rss_news_duplicates_total', 'Связано почти-дубликатов'),
+}
+METRICS_GAUGES = {
+    'pending_fetches': ('rss_pending_fetches', 'Загрузок и разборов в работе'),
+    'scheduled_sources': ('rss_scheduled_sources', 'Источников в расписании'),
+    'seen_urls': ('rss_seen_index_urls', 'Адресов в индексе просмотренных URL'),
+    'seen_db_lookups': ('rss_seen_index_db_lookups', 'Обращений индекса URL к БД'),
+    'seen_false_positives': ('rss_seen_index_false_positives', 'Ложных срабатываний фильтра Блума'),
+}
+
+class Histogram:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize_poll_samples(samples):
+    # samples - опросы источника в порядке от новых к старым
+    summary = {
+        'polls': len(samples),
+        'errors': sum(1 for sample in samples if sample.get('error')),
+        'last_poll': samples[0]['time'] if samples else None,
+        'last_status': str(samples[0].get('status', 'error')) if samples else None,
+        'last_error': next((sample['error'] for sample in samples if sample.get('error')), None),
+    }
+    for field in METRICS_TIMINGS:
+        values = [sample[field] for sample in samples if sample.get(field) is not None]
+        summary[field] = {
+            'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95),
+            'max': max(values) if values else None,
+        }
+    for field in METRICS_COUNTERS:
+        summary[field] = sum(sample.get(field) or 0 for sample in samples)
+    return summary
+
+class FetcherMetrics:
+    def __init__(self, history=METRICS_HISTORY):
+        self.history_size = history
+        self.lock = threading.Lock()
+        self.history = {}
+        self.histograms = {}
+        self.counters = {}
+        self.statuses = {}
+        self.gauges = {}
+        # Источники с опросами, ещё не сохранёнными в source_poll_stats
+        self.dirty = set()
+        # В процессе работает сборщик (fetch_rss_news); у веб-процессов без
+        # сборщика своих метрик опросов нет
+        self.active = False
+
+    def record(self, source_id, sample):
+        with self.lock:
+            if source_id not in self.history:
+                self.history[source_id] = deque(maxlen=self.history_size)
+            self.history[source_id].append(sample)
+            self.dirty.add(source_id)
+            
+            status = str(sample.get('status', 'error'))
+            self.statuses[source_id, status] = self.statuses.get((source_id, status), 0) + 1
+            for field in METRICS_TIMINGS:
+                if sample.get(field) is not None:
+                    key = (field, source_id)
+                    if key not in self.histograms:
+                        self.histograms[key] = Histogram()
+                    self.histograms[key].observe(sample[field])
+            for field in METRICS_COUNTERS:
+                if sample.get(field):
+                    self.counters[field, source_id] = self.counters.get((field, source_id), 0) + sample[field]
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def recent(self, source_id, limit=None):
+        with self.lock:
+            samples = list(self.history.get(source_id, ()))
+        return samples[-limit:][::-1] if limit else samples[::-1]
+
+    def summary(self, source_id):
+        return summarize_poll_samples(self.recent(source_id))
+
+    @retry_on_busy
+    def save(self, conn):
+        # Буферы изменившихся источников копируются в БД: при раздельном
+        # запуске (web/gunicorn + fetcher) статистику источника веб-процесс
+        # берёт оттуда
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            snapshot = [(source_id, json.dumps(list(self.history[source_id]))) for source_id in dirty]
+        if not snapshot:
+            return
+        now = datetime.now().isoformat()
+        try:
+            with conn:
+                conn.executemany('''
+                INSERT OR REPLACE INTO source_poll_stats (source_id, samples, updated_date)
+                VALUES (?, ?, ?)
+                ''', [(source_id, samples, now) for source_id, samples in snapshot])
+        except sqlite3.Error:
+            # Несохранённые источники будут записаны при следующей попытке
+            with self.lock:
+                self.dirty |= dirty
+            raise
+
+    def render_prometheus(self):
+        # Текстовый формат экспозиции Prometheus 0.0.4
+        lines = []
+        with self.lock:
+            for field, (name, help_text) in METRICS_TIMINGS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (key, source_id), histogram in sorted(self.histograms.items()):
+                    if key != field:
+                        continue
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{source_id="{source_id}",le="{bound}"}} {total}')
+                    lines.append(f'{name}_sum{{source_id="{source_id}"}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{source_id="{source_id}"}} {histogram.count}')
+            
+            lines += ['# HELP rss_fetch_total Опросов источника по статусу ответа', '# TYPE rss_fetch_total counter']
+            for (source_id, status), count in sorted(self.statuses.items()):
+                lines.append(f'rss_fetch_total{{source_id="{source_id}",status="{status}"}} {count}')
+            
+            for field, (name, help_text) in METRICS_COUNTERS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for (key, source_id), value in sorted(self.counters.items()):
+                    if key == field:
+                        lines.append(f'{name}{{source_id="{source_id}"}} {value}')
+            
+            for field, (name, help_text) in METRICS_GAUGES.items():
+                if field in self.gauges:
+                    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge',
+                              f'{name} {self.gauges[field]}']
+        return '\n'.join(lines) + '\n'
+
+fetcher_metrics = FetcherMetrics()
+
+def fetch_rss_news(stop_event=None, owner=None):
+    # Загрузка лент идёт параллельно в пуле потоков, а запись в БД
+    # выполняет только этот поток, владеющий соединением SQLite.
+    # Каждый источник опрашивается по своему расписанию (PollScheduler).
+    # При PARSE_PROCESSES > 0 загруженные ленты разбираются в пуле процессов,
+    # и в этот поток возвращаются только поля записей и найденные слова.
+    # Опрашиваются только арендованные источники (claim_sources), поэтому
+    # сборщиков может быть несколько. stop_event позволяет остановить сбор
+    stop_event = stop_event or threading.Event()
+    owner = owner or make_fetcher_id()
+    executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='rss-fetch')
+    parse_pool = None
+    scheduler = PollScheduler()
+    seen_index = SeenUrlIndex()
+    pending = {}
+    conn = None
+    last_keywords = None
+    last_sync = 0
+    fetcher_metrics.active = True
+
+    while not stop_event.is_set():
+        try:
+            if conn is None:
+                conn = connect_db()
+                seen_index.warm(conn)
+                source_cache = load_source_cache(conn)
+            elif seen_index.needs_rebuild:
+                seen_index.warm(conn)
+            
+            if time.time() - last_sync >= SCHEDULER_SYNC_INTERVAL:
+                scheduler.sync(claim_sources(conn, owner))
+                fetcher_metrics.save(conn)
+                # Валидаторы источников, полученных от другого сборщика
+                source_cache = load_source_cache(conn)
+                
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, word FROM keywords WHERE active = 1 ORDER BY id")
+                keywords = cursor.fetchall()
+                
+                # Автомат пересобирается только при изменении ключевых слов.
+                # Уже встреченные записи по новым словам проверяет дозаполнение
+                if keywords != last_keywords:
+                    matcher = build_keyword_matcher(keywords)
+                    keyword_names = dict(keywords)
+                    if PARSE_PROCESSES:
+                        if parse_pool is not None:
+                            parse_pool.shutdown(wait=False)
+                        parse_pool = create_parse_pool(keywords)
+                    last_keywords = keywords
+                last_sync = time.time()
+            
+            for source_id, source_url in scheduler.due(FETCH_WORKERS - len(pending)):
+                sample = {'time': datetime.now().isoformat(), 'started': time.perf_counter()}
+                future = executor.submit(fetch_source, source_url, source_cache.get(source_id),
+                                         parse_pool is None, sample, seen_index.might_be_seen)
+                pending[future] = (source_id, source_url, None, None, sample)
+            
+            fetcher_metrics.set_gauge('pending_fetches', len(pending))
+            fetcher_metrics.set_gauge('scheduled_sources', len(scheduler.sources))
+            
+            timeout = SCHEDULER_SYNC_INTERVAL
+            next_poll = scheduler.seconds_until_next()
+            if next_poll is not None and len(pending) < FETCH_WORKERS:
+                timeout = min(timeout, next_poll)
+            if not pending:
+                stop_event.wait(timeout)
+                continue
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                source_id, source_url, pool, validators, sample = pending.pop(future)
+                try:
+                    if pool is None:
+                        parsed, validators = future.result()
+                        if parsed is not None and parse_pool is not None:
+                            # Загрузка завершена, разбор передаётся в пул процессов
+                            parse_future = parse_pool.submit(parse_feed_in_worker, *parsed)
+                            pending[parse_future] = (source_id, source_url, parse_pool, validators, sample)
+                            continue
+                    else:
+                        parsed = future.result()
+                        if pool is not parse_pool:
+                            # Разобрано со старым набором ключевых слов
+                            for entry in parsed['entries']:
+                                entry['keyword_ids'] = None
+                    
+                    if parsed is not None:
+                        sample.update(parse_seconds=parsed['parse_seconds'], match_seconds=parsed['match_seconds'])
+                        items, unmatched = collect_new_entries(conn, source_id, parsed['entries'], matcher,
+                                                               seen_index, sample)
+                        write_started = time.perf_counter()
+                        stored = write_news_batch(conn, items, keyword_names)
+                        save_unmatched_entries(conn, unmatched)
+                        sample.update(write_seconds=time.perf_counter() - write_started, stored=len(stored),
+                                      duplicates=sum(1 for item in items if 'duplicate_of' in item))
+                        # Сохранённые, уже известные, связанные дубликаты и
+                        # записи без совпадений больше не разбираются
+                        for item in items + unmatched:
+                            seen_index.add(item['url'])
+                        news_bus.publish_local(stored)
+                        if stored:
+                            invalidate_responses(conn)
+                        scheduler.record_success(source_id, parsed)
+                    else:
+                        scheduler.record_not_modified(source_id)
+                    if validators != source_cache.get(source_id):
+                        save_source_cache(conn, source_id, validators)
+                        source_cache[source_id] = validators
+                except Exception as e:
+                    scheduler.record_error(source_id)
+                    sample.update(status=getattr(e, 'code', 'error'), error=str(e))
+                    print(f"[{datetime.now()}] Ошибка при обработке источника {source_url}: {e}")
+                    if isinstance(e, BrokenProcessPool) and pool is parse_pool:
+                        parse_pool = create_parse_pool(last_keywords)
+                sample['total_seconds'] = time.perf_counter() - sample.pop('started')
+                fetcher_metrics.record(source_id, sample)
+            
+            fetcher_metrics.set_gauge('seen_urls', seen_index.bloom.count)
+            fetcher_metrics.set_gauge('seen_db_lookups', seen_index.db_lookups)
+            fetcher_metrics.set_gauge('seen_false_positives', seen_index.false_positives)
+        except Exception as e:
+            print(f"[{datetime.now()}] Ошибка в процессе сбора новостей: {e}")
+            if conn is not None:
+                conn.close()
+                conn = None
+            stop_event.wait(POLL_MIN_INTERVAL)
+    
+    executor.shutdown(wait=False, cancel_futures=True)
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+    if conn is not None:
+        try:
+            fetcher_metrics.save(conn)
+        except sqlite3.Error as e:
+            print(f"[{datetime.now()}] Не удалось сохранить статистику опросов: {e}")
+        try:
+            release_sources(conn, owner)
+        except sqlite3.Error as e:
+            print(f"[{datetime.now()}] Не удалось освободить источники: {e}")
+        conn.close()
+
+
+BACKFILL_CHUNK_SIZE = 1000
+BACKFILL_CHUNK_PAUSE = 0.05
+BACKFILL_POLL_INTERVAL = 5
+UNMATCHED_RETENTION_DAYS = 7
+UNMATCHED_PRUNE_INTERVAL = 3600
+
+def schedule_keyword_backfill(cursor, keyword_id):
+    now = datetime.now().isoformat()
+    cursor.execute('''
+    INSERT OR REPLACE INTO keyword_backfill
+        (keyword_id, status, news_cursor, unmatched_cursor, scanned, matched, created_date, updated_date)
+    VALUES (?, 'pending', 0, 0, 0, 0, ?, ?)
+    ''', (keyword_id, now, now))
+
+def keyword_fts_phrase(word):
+    # Фраза FTS5 из слов ключевого слова: индекс отбирает кандидатов,
+    # а окончательную проверку делает тот же автомат, что и при сборе
+    tokens = re.findall(r'\w+', word)
+    return '"' + ' '.join(tokens) + '"' if tokens else None
+
+@retry_on_busy
+def backfill_news_chunk(conn, job, word):
+    # Связывает уже сохранённые новости с ключевым словом
+    cursor = conn.cursor()
+    keyword_id = job['keyword_id']
+    phrase = keyword_fts_phrase(word)
+    
+    if phrase:
+        cursor.execute('''
+        SELECT n.id, n.title, n.content, n.source_id, n.found_date
+        FROM news_fts
+        JOIN news n ON n.id = news_fts.rowid
+        WHERE news_fts MATCH ? AND news_fts.rowid > ?
+        ORDER BY news_fts.rowid
+        LIMIT ?
+        ''', (phrase, job['news_cursor'], BACKFILL_CHUNK_SIZE))
+    else:
+        cursor.execute('''
+        SELECT id, title, content, source_id, found_date FROM news
+        WHERE id > ? ORDER BY id LIMIT ?
+        ''', (job['news_cursor'], BACKFILL_CHUNK_SIZE))
+    rows = cursor.fetchall()
+    
+    matcher = build_keyword_matcher([(keyword_id, word)])
+    matched = [row for row in rows if matcher.match(row[1], row[2] or '')]
+    
+    with conn:
+        # Связь могла уже появиться при сборе - в счётчики попадают только новые
+        links = []
+        for news_id, _, _, source_id, found_date in matched:
+            cursor.execute("INSERT OR IGNORE INTO news_keywords (news_id, keyword_id) VALUES (?, ?)",
+                           (news_id, keyword_id))
+            if cursor.rowcount and source_id is not None and found_date:
+                links.append((keyword_id, source_id, found_date))
+        record_hits(cursor, [], links)
+        cursor.execute('''
+        UPDATE keyword_backfill
+        SET status = ?, news_cursor = ?, scanned = scanned + ?, matched = matched + ?, updated_date = ?
+        WHERE keyword_id = ?
+        ''', ('news' if rows else 'unmatched', rows[-1][0] if rows else job['news_cursor'],
+              len(rows), len(matched), datetime.now().isoformat(), keyword_id))
+    return len(matched)
+
+@retry_on_busy
+def backfill_unmatched_chunk(conn, job):
+    # Переносит в news записи из окна несовпавших, подходящие теперь
+    # под любое активное ключевое слово
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT id, title, content, url, source_id, published_date
+    FROM unmatched_entries
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+    ''', (job['unmatched_cursor'], BACKFILL_CHUNK_SIZE))
+    rows = cursor.fetchall()
+    
+    cursor.execute("SELECT id, word FROM keywords WHERE active = 1 ORDER BY id")
+    keywords = cursor.fetchall()
+    matcher = build_keyword_matcher(keywords)
+    
+    items = []
+    for entry_id, title, content, url, source_id, published in rows:
+        matched_keywords = matcher.match(title, content or '')
+        if matched_keywords:
+            items.append({
+                'title': title,
+                'content': content,
+                'url': url,
+                'source_id': source_id,
+                'published_date': published,
+                'found_date': datetime.now().isoformat(),
+                'summary': make_summary(content),
+                'thumbnail_url': find_thumbnail(content),
+                'keyword_ids': matched_keywords,
+            })
+    stored = write_news_batch(conn, items, dict(keywords))
+    
+    with conn:
+        cursor.execute('''
+        UPDATE keyword_backfill
+        SET status = ?, unmatched_cursor = ?, scanned = scanned + ?, matched = matched + ?, updated_date = ?
+        WHERE keyword_id = ?
+        ''', ('unmatched' if rows else 'done', rows[-1][0] if rows else job['unmatched_cursor'],
+              len(rows), len(stored), datetime.now().isoformat(), job['keyword_id']))
+    
+    if not rows:
+        print(f"[{datetime.now()}] Дозаполнение по ключевому слову «{job['word']}» завершено: "
+              f"проверено {job['scanned']}, найдено {job['matched']}")
+    news_bus.publish_local(stored)
+    return len(stored)
+
+@retry_on_busy
+def prune_unmatched_entries(conn):
+    cutoff = (datetime.now() - timedelta(days=UNMATCHED_RETENTION_DAYS)).isoformat()
+    with conn:
+        conn.execute("DELETE FROM unmatched_entries WHERE seen_date < ?", (cutoff,))
+
+def run_keyword_backfill():
+    # Фоновое дозаполнение: задания из keyword_backfill обрабатываются
+    # порциями, позиция сохраняется после каждой, поэтому после
+    # перезапуска работа продолжается с того же места
+    conn = None
+    last_prune = 0
+
+    while True:
+        try:
+            if conn is None:
+                conn = connect_db()
+                conn.row_factory = sqlite3.Row
+            
+            if time.time() - last_prune >= UNMATCHED_PRUNE_INTERVAL:
+                prune_unmatched_entries(conn)
+                last_prune = time.time()
+            
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT b.*, k.word
+            FROM keyword_backfill b
+            JOIN keywords k ON k.id = b.keyword_id
+            WHERE b.status != 'done' AND k.active = 1
+            ORDER BY b.created_date
+            LIMIT 1
+            ''')
+            job = cursor.fetchone()
+            if job is None:
+                time.sleep(BACKFILL_POLL_INTERVAL)
+                continue
+            
+            if job['status'] == 'pending':
+                print(f"[{datetime.now()}] Дозаполнение по ключевому слову «{job['word']}» начато")
+            if job['status'] in ('pending', 'news'):
+                matched = backfill_news_chunk(conn, job, job['word'])
+            else:
+                matched = backfill_unmatched_chunk(conn, job)
+            if matched:
+                invalidate_responses(conn)
+            time.sleep(BACKFILL_CHUNK_PAUSE)
+        except Exception as e:
+            print(f"[{datetime.now()}] Ошибка дозаполнения ключевых слов: {e}")
+            if conn is not None:
+                conn.close()
+                conn = None
+            time.sleep(BACKFILL_POLL_INTERVAL)
+
+NEWS_BACKFILL_CHUNK_SIZE = 500
+NEWS_BACKFILL_CHUNK_PAUSE = 0.05
+
+@retry_on_busy
+def fingerprint_news_chunk(conn):
+    # Канонические URL и отпечатки порции новостей, сохранённых до миграции 4.
+    # Позиция хранится в app_state, поэтому после перезапуска работа
+    # продолжается с того же места. Возвращает число обработанных новостей
+    cursor = conn.cursor()
+    last_id, until = load_news_backfill(cursor, 'fingerprint')
+    if last_id >= until:
+        return 0
+    
+    cursor.execute('''
+    SELECT id, url, title, content FROM news
+    WHERE id > ? AND id <= ?
+    ORDER BY id
+    LIMIT ?
+    ''', (last_id, until, NEWS_BACKFILL_CHUNK_SIZE))
+    rows = [(news_id, url, news_fingerprint(title, content)) for news_id, url, title, content in cursor.fetchall()]
+    
+    with conn:
+        for news_id, url, fingerprint in rows:
+            canonical = canonicalize_url(url)
+            if canonical != url:
+                try:
+                    cursor.execute("UPDATE news SET url = ? WHERE id = ?", (canonical, news_id))
+                except sqlite3.IntegrityError:
+                    # Такой канонический URL уже занят - адрес остаётся прежним
+                    pass
+            store_news_fingerprint(cursor, news_id, fingerprint)
+        cursor.execute("UPDATE app_state SET value = ? WHERE key = 'fingerprint_cursor'",
+                       (rows[-1][0] if rows else until,))
+    return len(rows)
+
+@retry_on_busy
+def summarize_news_chunk(conn):
+    # Краткое содержание и картинка порции новостей, сохранённых до миграции 8
+    cursor = conn.cursor()
+    last_id, until = load_news_backfill(cursor, 'summary')
+    if last_id >= until:
+        return 0
+    
+    cursor.execute('''
+    SELECT id, content FROM news
+    WHERE id > ? AND id <= ?
+    ORDER BY id
+    LIMIT ?
+    ''', (last_id, until, NEWS_BACKFILL_CHUNK_SIZE))
+    rows = cursor.fetchall()
+    
+    with conn:
+        # Новость, перезаписанную за это время сборщиком, не трогаем
+        cursor.executemany("UPDATE news SET summary = ?, thumbnail_url = ? WHERE id = ? AND summary IS NULL",
+                           [(make_summary(content), find_thumbnail(content), news_id) for news_id, content in rows])
+        last_id = rows[-1][0] if rows else until
+        cursor.execute("UPDATE app_state SET value = ? WHERE key = 'summary_cursor'", (last_id,))
+    if last_id >= until:
+        # Кэшированные списки ещё без кратких описаний
+        invalidate_responses(conn)
+    return len(rows)
+
+def run_news_backfill(process_chunk, title):
+    # Фоновая обработка новостей, сохранённых до миграции, порциями
+    # process_chunk; завершается, когда обработан весь диапазон
+    conn = None
+    processed = 0
+    
+    while True:
+        try:
+            if conn is None:
+                conn = connect_db()
+            count = process_chunk(conn)
+            if not count:
+                break
+            if not processed:
+                print(f"[{datetime.now()}] {title}: обработка сохранённых новостей начата")
+            processed += count
+            time.sleep(NEWS_BACKFILL_CHUNK_PAUSE)
+        except Exception as e:
+            print(f"[{datetime.now()}] {title}: ошибка обработки сохранённых новостей: {e}")
+            if conn is not None:
+                conn.close()
+                conn = None
+            time.sleep(BACKFILL_POLL_INTERVAL)
+    
+    if processed:
+        print(f"[{datetime.now()}] {title}: обработано сохранённых новостей {processed}")
+    conn.close()
+
+# Хранение новостей: в основной базе остаются свежие записи, старые
+# переносятся в архивную базу со сжатым текстом. У источника могут быть
+# свои retention_days и retention_max_news, иначе действуют общие значения.
+# Общие значения по умолчанию выключены (0): без явной настройки ничего
+# не архивируется, а API читает только основную базу
+NEWS_RETENTION_DAYS = 0
+# Общий предел числа новостей в основной базе, 0 - без предела
+NEWS_RETENTION_MAX_ROWS = 0
+# Новости моложе этого срока не архивируются даже по пределу размера:
+# пока запись держится в ленте, её URL должен быть в основной базе,
+# иначе она будет собрана повторно
+NEWS_RETENTION_MIN_DAYS = 3
+RETENTION_CHUNK_SIZE = 500
+RETENTION_INTERVAL = 3600
+ARCHIVE_DB_PATH = "rss_monitor_archive.db"
+ARCHIVE_COMPRESS_LEVEL = 6
+# Свободные страницы возвращаются порциями, чтобы не держать запись долго
+VACUUM_PAGES_PER_STEP = 1000
+
+def attach_archive(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA database_list")
+    if any(row[1] == 'archive' for row in cursor.fetchall()):
+        return
+    
+    cursor.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive.news_archive (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        content BLOB,
+        url TEXT NOT NULL,
+        source_id INTEGER,
+        published_date TEXT,
+        found_date TEXT,
+        keywords TEXT,
+        archived_date TEXT
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_news_archive_url ON news_archive (url)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_news_archive_source ON news_archive (source_id, found_date)")
+    conn.commit()
+
+def detach_archive(conn):
+    if conn.in_transaction:
+        conn.rollback()
+    conn.execute("DETACH DATABASE archive")
+
+def select_expired_news(cursor, now):
+    # id новостей, вышедших за политику хранения своего источника
+    guard = (now - timedelta(days=NEWS_RETENTION_MIN_DAYS)).isoformat()
+    expired = set()
+    
+    def age_cutoff(days):
+        return min(guard, (now - timedelta(days=days)).isoformat())
+    
+    cursor.execute("SELECT id, retention_days, retention_max_news FROM sources")
+    for source_id, days, max_news in cursor.fetchall():
+        days = NEWS_RETENTION_DAYS if days is None else days
+        if days:
+            cursor.execute("SELECT id FROM news WHERE source_id = ? AND found_date < ?",
+                           (source_id, age_cutoff(days)))
+            expired.update(row[0] for row in cursor.fetchall())
+        if max_news:
+            cursor.execute('''
+            SELECT id FROM (
+                SELECT id, found_date FROM news WHERE source_id = ?
+                ORDER BY found_date DESC LIMIT -1 OFFSET ?
+            ) WHERE found_date < ?
+            ''', (source_id, max_news, guard))
+            expired.update(row[0] for row in cursor.fetchall())
+    
+    # Новости удалённых источников подчиняются общему сроку
+    if NEWS_RETENTION_DAYS:
+        cursor.execute('''
+        SELECT id FROM news
+        WHERE source_id NOT IN (SELECT id FROM sources) AND found_date < ?
+        ''', (age_cutoff(NEWS_RETENTION_DAYS),))
+        expired.update(row[0] for row in cursor.fetchall())
+    
+    if NEWS_RETENTION_MAX_ROWS:
+        cursor.execute('''
+        SELECT id FROM (
+            SELECT id, found_date FROM news
+            ORDER BY found_date DESC LIMIT -1 OFFSET ?
+        ) WHERE found_date < ?
+        ''', (NEWS_RETENTION_MAX_ROWS, guard))
+        expired.update(row[0] for row in cursor.fetchall())
+    
+    return sorted(expired)
+
+@retry_on_busy
+def archive_news_chunk(conn, news_ids):
+    # Копирует новости в архив и удаляет их из основной базы вместе со
+    # связями, отпечатками и ссылками дубликатов; FTS чистится триггером.
+    # URL новостей и их дубликатов остаются в archived_urls: запись может
+    # ещё держаться в ленте и иначе была бы собрана заново
+    cursor = conn.cursor()
+    placeholders = ','.join('?' * len(news_ids))
+    cursor.execute(f'''
+    SELECT id, title, content, url, source_id, published_date, found_date
+    FROM news WHERE id IN ({placeholders})
+    ''', news_ids)
+    rows = cursor.fetchall()
+    keywords = load_news_keywords(cursor, [row[0] for row in rows])
+    archived_date = datetime.now().isoformat()
+    
+    with conn:
+        cursor.executemany('''
+        INSERT OR REPLACE INTO archive.news_archive
+            (id, title, content, url, source_id, published_date, found_date, keywords, archived_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(news_id, title, zlib.compress((content or '').encode('utf-8'), ARCHIVE_COMPRESS_LEVEL),
+               url, source_id, published, found, json.dumps(keywords[news_id], ensure_ascii=False),
+               archived_date)
+              for news_id, title, content, url, source_id, published, found in rows])
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO archived_urls (url)
+        SELECT url FROM news WHERE id IN ({placeholders})
+        UNION ALL
+        SELECT url FROM news_duplicates WHERE news_id IN ({placeholders})
+        ''', news_ids + news_ids)
+        for table, column in (('news_keywords', 'news_id'), ('news_simhash', 'news_id'),
+                              ('news_duplicates', 'news_id'), ('news', 'id')):
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", news_ids)
+    return len(rows)
+
+def enable_incremental_vacuum(conn):
+    # Одноразовый перевод существующей базы в auto_vacuum = INCREMENTAL.
+    # VACUUM перестраивает весь файл и держит монопольную блокировку,
+    # поэтому выполняется отдельной командой, а не при запуске
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] == 2:
+        print(f"[{datetime.now()}] Инкрементальный auto_vacuum уже включён")
+        return
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("VACUUM")
+    print(f"[{datetime.now()}] Включён инкрементальный auto_vacuum")
+
+def reclaim_free_pages(conn):
+    # auto_vacuum = INCREMENTAL: освобождённые страницы возвращаются ОС.
+    # В другом режиме incremental_vacuum ничего не делает
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        return 0
+    
+    freed = 0
+    cursor.execute("PRAGMA freelist_count")
+    free_pages = cursor.fetchone()[0]
+    while free_pages:
+        # execute() делает лишь один шаг прагмы, executescript - все
+        conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP});")
+        cursor.execute("PRAGMA freelist_count")
+        remaining = cursor.fetchone()[0]
+        if remaining >= free_pages:
+            break
+        freed += free_pages - remaining
+        free_pages = remaining
+    return freed
+
+def apply_retention(conn):
+    expired = select_expired_news(conn.cursor(), datetime.now())
+    archived = 0
+    if expired:
+        attach_archive(conn)
+        try:
+            for start in range(0, len(expired), RETENTION_CHUNK_SIZE):
+                archived += archive_news_chunk(conn, expired[start:start + RETENTION_CHUNK_SIZE])
+        finally:
+            detach_archive(conn)
+    
+    if archived:
+        with conn:
+            conn.execute("INSERT INTO news_fts (news_fts) VALUES ('optimize')")
+        invalidate_responses(conn)
+    freed = reclaim_free_pages(conn)
+    if archived or freed:
+        print(f"[{datetime.now()}] Архивировано новостей: {archived}, освобождено страниц: {freed}")
+    return {'archived': archived, 'freed_pages': freed}
+
+def run_retention():
+    conn = None
+    
+    while True:
+        try:
+            if conn is None:
+                conn = connect_db()
+            apply_retention(conn)
+        except Exception as e:
+            print(f"[{datetime.now()}] Ошибка архивирования новостей: {e}")
+            if conn is not None:
+                conn.close()
+                conn = None
+        time.sleep(RETENTION_INTERVAL)
+
+def storage_report(conn):
+    # Размеры таблиц и индексов по виртуальной таблице dbstat
+    cursor = conn.cursor()
+    report = {}
+    for pragma in ('page_size', 'page_count', 'freelist_count', 'auto_vacuum'):
+        cursor.execute(f"PRAGMA {pragma}")
+        report[pragma] = cursor.fetchone()[0]
+    report['file_bytes'] = report['page_size'] * report['page_count']
+    wal_path = DB_PATH + '-wal'
+    report['wal_bytes'] = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    
+    cursor.execute('''
+    SELECT s.name, COALESCE(m.type, 'table'), COALESCE(m.tbl_name, s.name), SUM(s.pgsize), COUNT(*)
+    FROM dbstat s
+    LEFT JOIN sqlite_master m ON m.name = s.name
+    WHERE s.schema = 'main'
+    GROUP BY s.name
+    ORDER BY SUM(s.pgsize) DESC
+    ''')
+    report['objects'] = [{'name': name, 'type': kind, 'table': table, 'bytes': size, 'pages': pages}
+                         for name, kind, table, size, pages in cursor.fetchall()]
+    
+    report['archive_bytes'] = os.path.getsize(ARCHIVE_DB_PATH) if os.path.exists(ARCHIVE_DB_PATH) else 0
+    report['archived_news'] = 0
+    if report['archive_bytes']:
+        attach_archive(conn)
+        try:
+            cursor.execute("SELECT COUNT(*) FROM archive.news_archive")
+            report['archived_news'] = cursor.fetchone()[0]
+        finally:
+            detach_archive(conn)
+    return report
+
+def load_news_keywords(cursor, news_ids):
+    # Ключевые слова для всей страницы новостей одним запросом
+    keywords = {news_id: [] for news_id in news_ids}
+    if not keywords:
+        return keywords
+    
+    cursor.execute('''
+    SELECT nk.news_id, k.word
+    FROM news_keywords nk
+    JOIN keywords k ON k.id = nk.keyword_id
+    WHERE nk.news_id IN ({})
+    ORDER BY nk.news_id, nk.keyword_id
+    '''.format(','.join('?' * len(keywords))), list(keywords))
+    for news_id, word in cursor.fetchall():
+        keywords[news_id].append(word)
+    
+    return keywords
+
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 30
+CACHED_ENDPOINTS = {
+    'index', 'sources', 'keywords',
+    'news_news_list', 'news_news_item', 'sources_source_list', 'keywords_keyword_list',
+}
+
+class ResponseCache:
+    # LRU готовых ответов с TTL. Поколение увеличивается при любой записи
+    # в БД, и ответы, собранные в старом поколении, больше не выдаются.
+    # Записи других процессов видны по счётчику data_generation в БД
+    def __init__(self, size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.data_generation = None
+
+    def make_key(self, endpoint, view_args, args, fields_mask):
+        return (self.generation, endpoint, tuple(sorted(view_args.items())),
+                tuple(sorted(args.items(multi=True))), fields_mask)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def sync(self, data_generation):
+        with self.lock:
+            if data_generation != self.data_generation:
+                self.data_generation = data_generation
+                self.generation += 1
+                self.entries.clear()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response):
+        entry = {
+            'expires': time.monotonic() + self.ttl,
+            'body': response.get_data(),
+            'status': response.status_code,
+            'headers': list(response.headers.items()),
+        }
+        with self.lock:
+            if key[0] != self.generation:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+response_cache = ResponseCache()
+
+def read_data_generation(conn):
+    cursor = conn.execute("SELECT value FROM app_state WHERE key = 'data_generation'")
+    return cursor.fetchone()[0]
 
-        time.sleep(300)
+@retry_on_busy
+def invalidate_responses(conn):
+    # Счётчик в БД сбрасывает кэши ответов во всех веб-воркерах,
+    # а не только в процессе, который изменил данные
+    with conn:
+        conn.execute("UPDATE app_state SET value = value + 1 WHERE key = 'data_generation'")
+    response_cache.invalidate()
 
+@app.before_request
+def serve_cached_response():
+    if request.method != 'GET' or request.endpoint not in CACHED_ENDPOINTS:
+        return None
+    
+    response_cache.sync(read_data_generation(get_db()))
+    g.cache_key = response_cache.make_key(request.endpoint, request.view_args or {}, request.args,
+                                          request.headers.get('X-Fields'))
+    entry = response_cache.get(g.cache_key)
+    if entry is None:
+        return None
+    
+    g.cache_hit = True
+    response = Response(entry['body'], status=entry['status'], headers=entry['headers'])
+    return response.make_conditional(request)
+
+@app.after_request
+def store_cached_response(response):
+    # Любой успешный изменяющий запрос сбрасывает кэш ответов
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        invalidate_responses(get_db())
+        return response
+    
+    key = g.get('cache_key')
+    if key is None or g.get('cache_hit') or response.status_code != 200 or response.is_streamed:
+        return response
+    
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    response_cache.put(key, response)
+    return response.make_conditional(request)
 
 @app.route('/')
 def index():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
-    SELECT n.id, n.title, n.content, n.url, n.published_date, n.found_date, s.name as source_name
+    SELECT n.id, n.title, n.summary, n.thumbnail_url, n.url, n.published_date, n.found_date,
+           s.name as source_name
     FROM news n
     JOIN sources s ON n.source_id = s.id
     ORDER BY n.found_date DESC
@@ -176,39 +2778,29 @@ def index():
     ''')
     news = [dict(row) for row in cursor.fetchall()]
     
+    news_keywords = load_news_keywords(cursor, [item['id'] for item in news])
     for item in news:
-        cursor.execute('''
-        SELECT k.word
-        FROM keywords k
-        JOIN news_keywords nk ON k.id = nk.keyword_id
-        WHERE nk.news_id = ?
-        ''', (item['id'],))
-        keywords = [row[0] for row in cursor.fetchall()]
-        item['keywords'] = ', '.join(keywords)
-    
-    conn.close()
+        item['keywords'] = ', '.join(news_keywords[item['id']])
     
     return render_template('index.html', news=news)
 
 @app.route('/sources')
 def sources():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("SELECT * FROM sources ORDER BY name")
     sources = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('sources.html', sources=sources)
 
 @app.route('/sources/add', methods=['POST'])
+@retry_on_busy
 def add_source():
     name = request.form.get('name')
     url = request.form.get('url')
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
@@ -217,169 +2809,699 @@ def add_source():
     except sqlite3.IntegrityError:
         pass
     
-    conn.close()
-    
     return redirect(url_for('sources'))
 
 @app.route('/sources/delete/<int:source_id>', methods=['POST'])
+@retry_on_busy
 def delete_source(source_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("DELETE FROM sources WHERE id = ?", (source_id,))
+    cursor.execute("DELETE FROM source_cache WHERE source_id = ?", (source_id,))
+    cursor.execute("DELETE FROM source_hits WHERE source_id = ?", (source_id,))
+    cursor.execute("DELETE FROM keyword_source_hits WHERE source_id = ?", (source_id,))
+    cursor.execute("DELETE FROM source_poll_stats WHERE source_id = ?", (source_id,))
     conn.commit()
     
-    conn.close()
-    
     return redirect(url_for('sources'))
 
 @app.route('/sources/toggle/<int:source_id>', methods=['POST'])
+@retry_on_busy
 def toggle_source(source_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("UPDATE sources SET active = 1 - active WHERE id = ?", (source_id,))
     conn.commit()
     
-    conn.close()
-    
     return redirect(url_for('sources'))
 
 @app.route('/keywords')
 def keywords():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("SELECT * FROM keywords ORDER BY word")
     keywords = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('keywords.html', keywords=keywords)
 
 @app.route('/keywords/add', methods=['POST'])
+@retry_on_busy
 def add_keyword():
     word = request.form.get('word')
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
         cursor.execute("INSERT INTO keywords (word) VALUES (?)", (word,))
+        schedule_keyword_backfill(cursor, cursor.lastrowid)
         conn.commit()
     except sqlite3.IntegrityError:
         pass
     
-    conn.close()
-    
     return redirect(url_for('keywords'))
 
 @app.route('/keywords/delete/<int:keyword_id>', methods=['POST'])
+@retry_on_busy
 def delete_keyword(keyword_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("DELETE FROM keywords WHERE id = ?", (keyword_id,))
+    cursor.execute("DELETE FROM keyword_backfill WHERE keyword_id = ?", (keyword_id,))
+    cursor.execute("DELETE FROM keyword_hits WHERE keyword_id = ?", (keyword_id,))
+    cursor.execute("DELETE FROM keyword_source_hits WHERE keyword_id = ?", (keyword_id,))
     conn.commit()
     
-    conn.close()
-    
     return redirect(url_for('keywords'))
 
 @app.route('/keywords/toggle/<int:keyword_id>', methods=['POST'])
+@retry_on_busy
 def toggle_keyword(keyword_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("UPDATE keywords SET active = 1 - active WHERE id = ?", (keyword_id,))
+    cursor.execute("SELECT active FROM keywords WHERE id = ?", (keyword_id,))
+    row = cursor.fetchone()
+    if row and row['active']:
+        schedule_keyword_backfill(cursor, keyword_id)
     conn.commit()
     
-    conn.close()
-    
     return redirect(url_for('keywords'))
 
 # API эндпоинты 
+NEWS_PAGE_DEFAULT = 100
+NEWS_PAGE_MAX = 1000
+
+def parse_limit(args, default, maximum):
+    try:
+        return min(max(int(args.get('limit', default)), 1), maximum)
+    except ValueError:
+        api.abort(400, "Параметр limit должен быть числом")
+
+def parse_int_arg(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        api.abort(400, f"Параметр {name} должен быть числом")
+
+def parse_date_arg(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        api.abort(400, f"Параметр {name} должен быть датой в формате ISO 8601")
+    # found_date хранится в местном времени без пояса и сравнивается как
+    # строка, поэтому дата с поясом переводится в местное время
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return date.isoformat()
+
+def build_news_filters(args):
+    # Условия WHERE для запросов к news n JOIN sources s,
+    # общие для списка новостей и выгрузки
+    conditions = []
+    params = []
+    
+    keyword = args.get('keyword')
+    if keyword:
+        # Подходящие слова выбираются один раз, а не для каждой новости
+        conditions.append('''EXISTS (
+            SELECT 1 FROM news_keywords nk
+            WHERE nk.news_id = n.id AND nk.keyword_id IN (SELECT id FROM keywords WHERE word LIKE ?))''')
+        params.append(f"%{keyword}%")
+    
+    source = args.get('source')
+    if source:
+        conditions.append("s.name LIKE ?")
+        params.append(f"%{source}%")
+    
+    keyword_id = parse_int_arg(args, 'keyword_id')
+    if keyword_id is not None:
+        conditions.append("EXISTS (SELECT 1 FROM news_keywords nk WHERE nk.news_id = n.id AND nk.keyword_id = ?)")
+        params.append(keyword_id)
+    
+    source_id = parse_int_arg(args, 'source_id')
+    if source_id is not None:
+        conditions.append("n.source_id = ?")
+        params.append(source_id)
+    
+    since = parse_date_arg(args, 'since')
+    if since:
+        conditions.append("n.found_date >= ?")
+        params.append(since)
+    
+    until = parse_date_arg(args, 'until')
+    if until:
+        conditions.append("n.found_date < ?")
+        params.append(until)
+    
+    return conditions, params
+
+def encode_news_cursor(item):
+    data = json.dumps([item['found_date'], item['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_news_cursor(token):
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        found_date, news_id = json.loads(data)
+        return str(found_date), int(news_id)
+    except (ValueError, TypeError):
+        api.abort(400, "Некорректный параметр cursor")
+
+NEWS_FILTER_PARAMS = {
+    'keyword': 'Фильтр по ключевому слову',
+    'source': 'Фильтр по источнику',
+    'keyword_id': 'ID ключевого слова',
+    'source_id': 'ID источника',
+    'since': 'Найдены не раньше (ISO 8601)',
+    'until': 'Найдены раньше (ISO 8601)',
+}
+
 @news_ns.route('/')
 class NewsList(Resource):
     @news_ns.doc('get_news',
-        params={
-            'keyword': 'Фильтр по ключевому слову',
-            'source': 'Фильтр по источнику'
-        })
+        params=dict(NEWS_FILTER_PARAMS, **{
+            'limit': f'Размер страницы (не больше {NEWS_PAGE_MAX})',
+            'cursor': 'Курсор следующей страницы из заголовка X-Next-Cursor'
+        }))
+    @news_ns.header('X-Next-Cursor', 'Курсор следующей страницы, если она есть')
     @news_ns.marshal_list_with(news_model)
     def get(self):
-        """Получить список новостей с возможностью фильтрации"""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
+        """Получить список новостей с возможностью фильтрации и постраничного обхода"""
+        conn = get_db()
         cursor = conn.cursor()
         
-        keyword = request.args.get('keyword')
-        source = request.args.get('source')
+        conditions, params = build_news_filters(request.args)
+        limit = parse_limit(request.args, NEWS_PAGE_DEFAULT, NEWS_PAGE_MAX)
+        
+        # Постраничный обход по ключу (found_date, id) вместо OFFSET
+        token = request.args.get('cursor')
+        if token:
+            conditions.append("(n.found_date, n.id) < (?, ?)")
+            params.extend(decode_news_cursor(token))
         
         query = '''
-        SELECT n.id, n.title, n.content, n.url, n.published_date, n.found_date, s.name as source_name
+        SELECT n.id, n.title, n.summary, n.thumbnail_url, n.url, n.published_date, n.found_date,
+               s.name as source_name
         FROM news n
         JOIN sources s ON n.source_id = s.id
         '''
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY n.found_date DESC, n.id DESC LIMIT ?"
+        params.append(limit + 1)
         
-        params = []
-        conditions = []
+        cursor.execute(query, params)
+        news = [dict(row) for row in cursor.fetchall()]
+        
+        headers = {}
+        if len(news) > limit:
+            news = news[:limit]
+            headers['X-Next-Cursor'] = encode_news_cursor(news[-1])
+
+        news_keywords = load_news_keywords(cursor, [item['id'] for item in news])
+        for item in news:
+            item['keywords'] = news_keywords[item['id']]
         
-        if keyword:
-            query += '''
-            JOIN news_keywords nk ON n.id = nk.news_id
-            JOIN keywords k ON nk.keyword_id = k.id
-            '''
-            conditions.append("k.word LIKE ?")
-            params.append(f"%{keyword}%")
+        return news, 200, headers
+
+@news_ns.route('/<int:news_id>')
+@news_ns.param('news_id', 'ID новости')
+class NewsItem(Resource):
+    @news_ns.doc('get_news_item')
+    @news_ns.marshal_with(news_detail_model)
+    def get(self, news_id):
+        """Получить новость с полным содержанием"""
+        conn = get_db()
+        cursor = conn.cursor()
         
-        if source:
-            conditions.append("s.name LIKE ?")
-            params.append(f"%{source}%")
+        cursor.execute('''
+        SELECT n.id, n.title, n.content, n.summary, n.thumbnail_url, n.url, n.published_date, n.found_date,
+               s.name as source_name
+        FROM news n
+        LEFT JOIN sources s ON n.source_id = s.id
+        WHERE n.id = ?
+        ''', (news_id,))
+        item = cursor.fetchone()
+        if item is None:
+            api.abort(404, "Новость не найдена")
         
+        item = dict(item)
+        item['keywords'] = load_news_keywords(cursor, [news_id])[news_id]
+        return item
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FIELDS = ['id', 'title', 'content', 'url', 'published_date', 'found_date', 'source_name', 'keywords']
+
+def iter_news_export(conditions, params):
+    # Отдельное соединение живёт, пока клиент читает выгрузку;
+    # в памяти одновременно не больше EXPORT_CHUNK_SIZE строк
+    conn = connect_db(check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        query = '''
+        SELECT n.id, n.title, n.content, n.url, n.published_date, n.found_date, s.name as source_name
+        FROM news n
+        JOIN sources s ON n.source_id = s.id
+        '''
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
-        
-        query += " ORDER BY n.found_date DESC LIMIT 100"
-        
+        query += " ORDER BY n.found_date DESC, n.id DESC"
         cursor.execute(query, params)
-        news = [dict(row) for row in cursor.fetchall()]
+        
+        keywords_cursor = conn.cursor()
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            news = [dict(row) for row in rows]
+            news_keywords = load_news_keywords(keywords_cursor, [item['id'] for item in news])
+            for item in news:
+                item['keywords'] = news_keywords[item['id']]
+            yield news
+    finally:
+        conn.close()
 
+def format_ndjson(chunks):
+    for news in chunks:
+        yield ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in news).encode('utf-8')
+
+def format_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for news in chunks:
         for item in news:
-            cursor.execute('''
-            SELECT k.word
-            FROM keywords k
-            JOIN news_keywords nk ON k.id = nk.keyword_id
-            WHERE nk.news_id = ?
-            ''', (item['id'],))
-            keywords = [row[0] for row in cursor.fetchall()]
-            item['keywords'] = keywords
+            writer.writerow([', '.join(item[field]) if field == 'keywords' else item[field]
+                             for field in EXPORT_FIELDS])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+EXPORT_FORMATS = {
+    'ndjson': (format_ndjson, 'application/x-ndjson'),
+    'csv': (format_csv, 'text/csv; charset=utf-8'),
+}
+
+@news_ns.route('/export')
+class NewsExport(Resource):
+    @news_ns.doc('export_news',
+        params=dict(NEWS_FILTER_PARAMS, format='Формат выгрузки: ndjson (по умолчанию) или csv'))
+    @news_ns.produces(['application/x-ndjson', 'text/csv'])
+    def get(self):
+        """Потоковая выгрузка новостей (сжимается gzip, если клиент передал Accept-Encoding: gzip)"""
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in EXPORT_FORMATS:
+            api.abort(400, "Параметр format должен быть ndjson или csv")
+        formatter, mimetype = EXPORT_FORMATS[export_format]
+        
+        conditions, params = build_news_filters(request.args)
+        body = formatter(iter_news_export(conditions, params))
+        headers = {'Content-Disposition': f'attachment; filename=news.{export_format}'}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            body = gzip_stream(body)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+        
+        return Response(body, mimetype=mimetype, headers=headers)
+
+def parse_id_list(args, name):
+    ids = []
+    for value in args.getlist(name):
+        for part in value.split(','):
+            if part.strip():
+                try:
+                    ids.append(int(part))
+                except ValueError:
+                    api.abort(400, f"Параметр {name} должен содержать числа")
+    return ids
+
+def load_stream_events(conn, subscription, after_id):
+    cursor = conn.cursor()
+    conditions = ["n.id > ?"]
+    params = [after_id]
+    if subscription.source_ids:
+        conditions.append("n.source_id IN ({})".format(','.join('?' * len(subscription.source_ids))))
+        params.extend(subscription.source_ids)
+    if subscription.keyword_ids:
+        conditions.append('''EXISTS (SELECT 1 FROM news_keywords nk WHERE nk.news_id = n.id
+            AND nk.keyword_id IN ({}))'''.format(','.join('?' * len(subscription.keyword_ids))))
+        params.extend(subscription.keyword_ids)
+    params.append(STREAM_REPLAY_LIMIT)
+    
+    cursor.execute('''
+    SELECT n.id, n.title, n.url, n.source_id, n.published_date, n.found_date
+    FROM news n
+    WHERE {}
+    ORDER BY n.id
+    LIMIT ?
+    '''.format(' AND '.join(conditions)), params)
+    events = [dict(row) for row in cursor.fetchall()]
+    
+    news_keywords = load_news_keywords(cursor, [event['id'] for event in events])
+    for event in events:
+        event['keywords'] = news_keywords[event['id']]
+    return events
+
+def format_sse(event):
+    data = json.dumps(event, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: news\ndata: {data}\n\n"
+
+def iter_news_stream(keyword_ids, source_ids, last_id):
+    # Подписка создаётся внутри генератора, чтобы она снималась
+    # в finally при отключении клиента
+    subscription = news_bus.subscribe(keyword_ids, source_ids)
+    conn = connect_db(check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    try:
+        if last_id is None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM news")
+            last_id = cursor.fetchone()[0]
+            replay = False
+        else:
+            replay = True
         
+        yield f"retry: {int(STREAM_HEARTBEAT * 1000)}\n\n"
+        while True:
+            # Догрузка из БД после переподключения (Last-Event-ID)
+            # или переполнения очереди подписчика
+            if replay or subscription.lagging:
+                subscription.lagging = False
+                events = load_stream_events(conn, subscription, last_id)
+                for event in events:
+                    yield format_sse(event)
+                    last_id = event['id']
+                replay = len(events) == STREAM_REPLAY_LIMIT
+                continue
+            
+            try:
+                event = subscription.queue.get(timeout=STREAM_HEARTBEAT)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if event['id'] > last_id:
+                yield format_sse(event)
+                last_id = event['id']
+    finally:
+        news_bus.unsubscribe(subscription)
         conn.close()
+
+@news_ns.route('/stream')
+class NewsStream(Resource):
+    @news_ns.doc('stream_news',
+        params={
+            'keyword_id': 'ID ключевых слов через запятую',
+            'source_id': 'ID источников через запятую',
+            'last_event_id': 'ID последнего полученного события (или заголовок Last-Event-ID)'
+        })
+    @news_ns.produces(['text/event-stream'])
+    def get(self):
+        """Поток новых новостей в формате Server-Sent Events"""
+        last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if last_id is not None:
+            try:
+                last_id = int(last_id)
+            except ValueError:
+                api.abort(400, "Некорректный Last-Event-ID")
+        
+        stream = iter_news_stream(parse_id_list(request.args, 'keyword_id'),
+                                  parse_id_list(request.args, 'source_id'), last_id)
+        return Response(stream, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+def build_fts_query(text, prefix=False):
+    # Каждое слово берётся в кавычки, чтобы пользовательский ввод
+    # не разбирался как синтаксис запросов FTS5
+    terms = []
+    for term in text.split():
+        term = '"' + term.replace('"', '""') + '"'
+        terms.append(term + '*' if prefix else term)
+    return ' '.join(terms)
+
+@news_ns.route('/search')
+class NewsSearch(Resource):
+    @news_ns.doc('search_news',
+        params={
+            'q': 'Поисковый запрос (слова через пробел)',
+            'prefix': 'Искать по началу слов (true/false)',
+            'limit': f'Количество результатов (не больше {SEARCH_MAX_LIMIT})'
+        })
+    @news_ns.marshal_list_with(news_search_model)
+    def get(self):
+        """Полнотекстовый поиск по заголовкам и текстам новостей"""
+        text = request.args.get('q', '').strip()
+        if not text:
+            api.abort(400, "Требуется параметр q")
+        
+        prefix = request.args.get('prefix', 'false').lower() in ('1', 'true', 'yes')
+        limit = parse_limit(request.args, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT n.id, n.title, n.summary, n.thumbnail_url, n.url, n.published_date, n.found_date,
+               s.name as source_name, snippet(news_fts, -1, '<b>', '</b>', '…', 16) as snippet,
+               bm25(news_fts, 10.0, 1.0) as rank
+        FROM news_fts
+        JOIN news n ON n.id = news_fts.rowid
+        JOIN sources s ON n.source_id = s.id
+        WHERE news_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+        ''', (build_fts_query(text, prefix), limit))
+        news = [dict(row) for row in cursor.fetchall()]
+        
+        news_keywords = load_news_keywords(cursor, [item['id'] for item in news])
+        for item in news:
+            item['keywords'] = news_keywords[item['id']]
         
         return news
 
+# Пакетные операции: весь запрос выполняется одной транзакцией, ошибка
+# отдельного элемента попадает в отчёт и не отменяет остальные. Сборщик
+# видит изменения разом при следующей синхронизации и перестраивает
+# автомат ключевых слов один раз
+BATCH_MAX_ITEMS = 10000
+OPML_CONTENT_TYPE = 'text/x-opml; charset=utf-8'
+
+def parse_batch_items(data):
+    if not isinstance(data, list):
+        api.abort(400, "Ожидается JSON-массив")
+    if len(data) > BATCH_MAX_ITEMS:
+        api.abort(400, f"Не больше {BATCH_MAX_ITEMS} элементов за запрос")
+    return data
+
+def batch_report(results):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'results': results, 'counts': counts}
+
+def batch_flag(item, name):
+    # None - поле не задано, иначе 0 или 1
+    value = item.get(name) if isinstance(item, dict) else None
+    return None if value is None else int(bool(value))
+
+def find_batch_row(cursor, table, key_column, item):
+    # Элемент задаётся числом (id), строкой (URL или слово) или объектом
+    # с полем id либо key_column. ValueError - элемент задан неверно
+    if isinstance(item, dict):
+        item_id, key = item.get('id'), item.get(key_column)
+    elif isinstance(item, int) and not isinstance(item, bool):
+        item_id, key = item, None
+    else:
+        item_id, key = None, item
+    
+    if item_id is not None:
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            raise ValueError("Поле id должно быть целым числом")
+        cursor.execute(f"SELECT id, {key_column}, active FROM {table} WHERE id = ?", (item_id,))
+    elif isinstance(key, str) and key.strip():
+        cursor.execute(f"SELECT id, {key_column}, active FROM {table} WHERE {key_column} = ?", (key.strip(),))
+    else:
+        raise ValueError(f"Требуется поле id или {key_column}")
+    return cursor.fetchone()
+
+def upsert_sources(cursor, items):
+    results = []
+    for index, item in enumerate(items):
+        url = item.get('url') if isinstance(item, dict) else None
+        if not isinstance(url, str) or not url.strip():
+            results.append({'index': index, 'status': 'error', 'error': "Требуется поле url"})
+            continue
+        name = item.get('name')
+        if name is not None and not isinstance(name, str):
+            results.append({'index': index, 'status': 'error', 'error': "Поле name должно быть строкой"})
+            continue
+        url = url.strip()
+        name = (name or '').strip()
+        active = batch_flag(item, 'active')
+        
+        cursor.execute("SELECT id, name, active FROM sources WHERE url = ?", (url,))
+        row = cursor.fetchone()
+        if row is None:
+            active = 1 if active is None else active
+            cursor.execute("INSERT INTO sources (name, url, active) VALUES (?, ?, ?)", (name or url, url, active))
+            results.append({'index': index, 'key': url, 'id': cursor.lastrowid, 'status': 'created', 'active': active})
+            continue
+        
+        name = name or row['name']
+        active = row['active'] if active is None else active
+        status = 'unchanged'
+        if (name, active) != (row['name'], row['active']):
+            cursor.execute("UPDATE sources SET name = ?, active = ? WHERE id = ?", (name, active, row['id']))
+            status = 'updated'
+        results.append({'index': index, 'key': url, 'id': row['id'], 'status': status, 'active': active})
+    return results
+
+def upsert_keywords(cursor, items):
+    results = []
+    for index, item in enumerate(items):
+        word = item.get('word') if isinstance(item, dict) else item
+        if not isinstance(word, str) or not word.strip():
+            results.append({'index': index, 'status': 'error', 'error': "Требуется поле word"})
+            continue
+        word = word.strip()
+        active = batch_flag(item, 'active')
+        
+        cursor.execute("SELECT id, active FROM keywords WHERE word = ?", (word,))
+        row = cursor.fetchone()
+        if row is None:
+            active = 1 if active is None else active
+            cursor.execute("INSERT INTO keywords (word, active) VALUES (?, ?)", (word, active))
+            keyword_id = cursor.lastrowid
+            if active:
+                schedule_keyword_backfill(cursor, keyword_id)
+            results.append({'index': index, 'key': word, 'id': keyword_id, 'status': 'created', 'active': active})
+            continue
+        
+        status = 'unchanged'
+        if active is not None and active != row['active']:
+            cursor.execute("UPDATE keywords SET active = ? WHERE id = ?", (active, row['id']))
+            if active:
+                schedule_keyword_backfill(cursor, row['id'])
+            status = 'updated'
+        else:
+            active = row['active']
+        results.append({'index': index, 'key': word, 'id': row['id'], 'status': status, 'active': active})
+    return results
+
+def toggle_batch(cursor, table, key_column, items, on_activate=None):
+    # Без поля active статус инвертируется, иначе устанавливается
+    results = []
+    for index, item in enumerate(items):
+        try:
+            row = find_batch_row(cursor, table, key_column, item)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+            continue
+        if row is None:
+            results.append({'index': index, 'status': 'not_found'})
+            continue
+        
+        active = batch_flag(item, 'active')
+        active = 1 - row['active'] if active is None else active
+        status = 'unchanged'
+        if active != row['active']:
+            cursor.execute(f"UPDATE {table} SET active = ? WHERE id = ?", (active, row['id']))
+            if active and on_activate:
+                on_activate(cursor, row['id'])
+            status = 'updated'
+        results.append({'index': index, 'key': row[key_column], 'id': row['id'], 'status': status, 'active': active})
+    return results
+
+def delete_batch(cursor, table, key_column, items, dependents):
+    # dependents - (таблица, столбец) служебных записей удаляемой строки
+    results = []
+    for index, item in enumerate(items):
+        try:
+            row = find_batch_row(cursor, table, key_column, item)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+            continue
+        if row is None:
+            results.append({'index': index, 'status': 'not_found'})
+            continue
+        
+        cursor.execute(f"DELETE FROM {table} WHERE id = ?", (row['id'],))
+        for dependent_table, column in dependents:
+            cursor.execute(f"DELETE FROM {dependent_table} WHERE {column} = ?", (row['id'],))
+        results.append({'index': index, 'key': row[key_column], 'id': row['id'], 'status': 'deleted'})
+    return results
+
+def parse_opml(data):
+    # Источники из всех outline с xmlUrl, включая вложенные в категории
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError as e:
+        api.abort(400, f"Некорректный OPML: {e}")
+    if root.tag != 'opml':
+        api.abort(400, "Ожидается документ OPML")
+    
+    items = []
+    for outline in root.iter('outline'):
+        url = outline.get('xmlUrl')
+        if url:
+            items.append({'name': outline.get('title') or outline.get('text') or '', 'url': url})
+    return items
+
+def build_opml(sources):
+    root = ElementTree.Element('opml', version='2.0')
+    head = ElementTree.SubElement(root, 'head')
+    ElementTree.SubElement(head, 'title').text = 'RSS Monitor'
+    ElementTree.SubElement(head, 'dateCreated').text = format_datetime(datetime.now().astimezone())
+    body = ElementTree.SubElement(root, 'body')
+    for source in sources:
+        ElementTree.SubElement(body, 'outline', type='rss', text=source['name'], title=source['name'],
+                               xmlUrl=source['url'])
+    ElementTree.indent(root)
+    return ElementTree.tostring(root, encoding='utf-8', xml_declaration=True)
+
 @sources_ns.route('/')
 class SourceList(Resource):
     @sources_ns.doc('get_sources')
     @sources_ns.marshal_list_with(source_model)
     def get(self):
         """Получить список всех источников"""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM sources ORDER BY name")
         sources = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
-        
         return sources
 
     @sources_ns.doc('create_source')
     @sources_ns.expect(source_model)
     @sources_ns.marshal_with(source_model, code=201)
+    @retry_on_busy
     def post(self):
         """Добавить новый источник"""
         data = request.json
@@ -389,56 +3511,258 @@ class SourceList(Resource):
         if not name or not url:
             api.abort(400, "Требуются поля name и url")
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
             cursor.execute("INSERT INTO sources (name, url) VALUES (?, ?)", (name, url))
             conn.commit()
             source_id = cursor.lastrowid
-            conn.close()
             
             return {"id": source_id, "name": name, "url": url, "active": 1}, 201
         except sqlite3.IntegrityError:
-            conn.close()
             api.abort(400, "Источник с таким URL уже существует")
 
+@sources_ns.route('/batch')
+class SourceBatch(Resource):
+    @sources_ns.doc('upsert_sources', body=[source_model])
+    @sources_ns.marshal_with(batch_result_model)
+    @retry_on_busy
+    def post(self):
+        """Добавить или обновить источники списком (ключ - url)"""
+        items = parse_batch_items(request.get_json(silent=True))
+        conn = get_db()
+        results = upsert_sources(conn.cursor(), items)
+        conn.commit()
+        return batch_report(results)
+
+@sources_ns.route('/batch/toggle')
+class SourceBatchToggle(Resource):
+    @sources_ns.doc('toggle_sources')
+    @sources_ns.marshal_with(batch_result_model)
+    @retry_on_busy
+    def post(self):
+        """Включить или выключить источники списком"""
+        items = parse_batch_items(request.get_json(silent=True))
+        conn = get_db()
+        results = toggle_batch(conn.cursor(), 'sources', 'url', items)
+        conn.commit()
+        return batch_report(results)
+
+@sources_ns.route('/batch/delete')
+class SourceBatchDelete(Resource):
+    @sources_ns.doc('delete_sources')
+    @sources_ns.marshal_with(batch_result_model)
+    @retry_on_busy
+    def post(self):
+        """Удалить источники списком"""
+        items = parse_batch_items(request.get_json(silent=True))
+        conn = get_db()
+        results = delete_batch(conn.cursor(), 'sources', 'url', items, [
+            ('source_cache', 'source_id'), ('source_hits', 'source_id'), ('keyword_source_hits', 'source_id'),
+            ('source_poll_stats', 'source_id')])
+        conn.commit()
+        return batch_report(results)
+
+@sources_ns.route('/opml')
+class SourceOpml(Resource):
+    @sources_ns.doc('export_opml')
+    @sources_ns.produces(['text/x-opml'])
+    def get(self):
+        """Выгрузить источники в OPML"""
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT name, url FROM sources ORDER BY name")
+        response = Response(build_opml(cursor.fetchall()), content_type=OPML_CONTENT_TYPE)
+        response.headers['Content-Disposition'] = 'attachment; filename="sources.opml"'
+        return response
+
+    @sources_ns.doc('import_opml')
+    @sources_ns.marshal_with(batch_result_model)
+    @retry_on_busy
+    def post(self):
+        """Загрузить источники из OPML (тело запроса или файл file)"""
+        upload = request.files.get('file')
+        items = parse_batch_items(parse_opml(upload.read() if upload else request.get_data()))
+        conn = get_db()
+        results = upsert_sources(conn.cursor(), items)
+        conn.commit()
+        return batch_report(results)
+
 @sources_ns.route('/<int:source_id>')
 @sources_ns.param('source_id', 'ID источника')
 class Source(Resource):
     @sources_ns.doc('delete_source')
     @sources_ns.response(204, 'Источник удален')
+    @retry_on_busy
     def delete(self, source_id):
         """Удалить источник"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute("DELETE FROM sources WHERE id = ?", (source_id,))
+        cursor.execute("DELETE FROM source_cache WHERE source_id = ?", (source_id,))
+        cursor.execute("DELETE FROM source_hits WHERE source_id = ?", (source_id,))
+        cursor.execute("DELETE FROM keyword_source_hits WHERE source_id = ?", (source_id,))
+        cursor.execute("DELETE FROM source_poll_stats WHERE source_id = ?", (source_id,))
         conn.commit()
-        conn.close()
         
         return '', 204
 
+STATS_DEFAULT_BUCKETS = {'hour': 48, 'day': 30}
+STATS_MAX_BUCKETS = 1000
+STATS_TOP_LIMIT = 10
+STATS_PARAMS = {
+    'period': 'Шаг ряда: hour или day (по умолчанию day)',
+    'since': 'Начало окна (ISO 8601), по умолчанию 48 часов или 30 дней назад',
+    'until': 'Конец окна (ISO 8601, не включительно), по умолчанию текущий момент'
+}
+
+def parse_stats_window(args):
+    # Возвращает период и начала всех периодов окна [since, until)
+    period = args.get('period', 'day')
+    if period not in STATS_PERIODS:
+        api.abort(400, "Параметр period должен быть hour или day")
+    step = STATS_PERIODS[period]
+    
+    until = parse_date_arg(args, 'until')
+    until = datetime.fromisoformat(until) if until else datetime.now()
+    since = parse_date_arg(args, 'since')
+    since = datetime.fromisoformat(since) if since else until - step * STATS_DEFAULT_BUCKETS[period]
+    
+    buckets = []
+    current = datetime.fromisoformat(stats_bucket(since.isoformat(), period))
+    while current < until:
+        if len(buckets) == STATS_MAX_BUCKETS:
+            api.abort(400, f"Окно слишком велико: не больше {STATS_MAX_BUCKETS} периодов")
+        buckets.append(stats_bucket(current.isoformat(), period))
+        current += step
+    return period, buckets
+
+def load_hit_series(cursor, table, key_column, key, period, buckets):
+    # Ряд по счётчикам; периоды без совпадений заполняются нулями
+    if not buckets:
+        return []
+    cursor.execute(f'''
+    SELECT bucket, hits FROM {table}
+    WHERE {key_column} = ? AND period = ? AND bucket BETWEEN ? AND ?
+    ''', (key, period, buckets[0], buckets[-1]))
+    hits = {row['bucket']: row['hits'] for row in cursor.fetchall()}
+    return [{'bucket': bucket, 'hits': hits.get(bucket, 0)} for bucket in buckets]
+
+def load_top_hits(cursor, key_column, key, rank_column, rank_table, rank_name, buckets):
+    # Самые частые источники ключевого слова или ключевые слова источника.
+    # Счётчики пар посуточные, поэтому окно округляется до целых дней
+    if not buckets:
+        return []
+    cursor.execute(f'''
+    SELECT h.{rank_column} AS id, r.{rank_name} AS name, SUM(h.hits) AS hits
+    FROM keyword_source_hits h
+    LEFT JOIN {rank_table} r ON r.id = h.{rank_column}
+    WHERE h.{key_column} = ? AND h.day BETWEEN ? AND ?
+    GROUP BY h.{rank_column}
+    ORDER BY hits DESC
+    LIMIT ?
+    ''', (key, buckets[0][:10], buckets[-1][:10], STATS_TOP_LIMIT))
+    return [dict(row) for row in cursor.fetchall()]
+
+def load_poll_samples(cursor, source_id):
+    # Опросы источника от новых к старым: из памяти, если источник опрашивает
+    # этот процесс, иначе из копии, которую сборщик сохраняет в БД
+    samples = fetcher_metrics.recent(source_id)
+    cursor.execute("SELECT samples FROM source_poll_stats WHERE source_id = ?", (source_id,))
+    row = cursor.fetchone()
+    stored = json.loads(row[0])[::-1] if row else []
+    if stored and (not samples or stored[0]['time'] > samples[0]['time']):
+        return stored
+    return samples
+
+@sources_ns.route('/<int:source_id>/stats')
+@sources_ns.param('source_id', 'ID источника')
+class SourceStats(Resource):
+    @sources_ns.doc('get_source_stats', params=dict(STATS_PARAMS, limit='Сколько последних опросов вернуть (по умолчанию 20)'))
+    @sources_ns.marshal_with(source_stats_model)
+    def get(self, source_id):
+        """Получить статистику опросов и ряд сохранённых новостей источника"""
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id FROM sources WHERE id = ?", (source_id,))
+        if cursor.fetchone() is None:
+            api.abort(404, "Источник не найден")
+        
+        period, buckets = parse_stats_window(request.args)
+        samples = load_poll_samples(cursor, source_id)
+        stats = summarize_poll_samples(samples)
+        stats['source_id'] = source_id
+        stats['recent'] = samples[:parse_limit(request.args, 20, METRICS_HISTORY)]
+        stats['period'] = period
+        stats['series'] = load_hit_series(cursor, 'source_hits', 'source_id', source_id, period, buckets)
+        stats['total'] = sum(point['hits'] for point in stats['series'])
+        stats['top_keywords'] = load_top_hits(cursor, 'source_id', source_id, 'keyword_id', 'keywords', 'word', buckets)
+        return stats
+
+@sources_ns.route('/<int:source_id>/retention')
+@sources_ns.param('source_id', 'ID источника')
+class SourceRetention(Resource):
+    @sources_ns.doc('get_source_retention')
+    @sources_ns.marshal_with(retention_model)
+    def get(self, source_id):
+        """Получить политику хранения новостей источника"""
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id AS source_id, retention_days, retention_max_news FROM sources WHERE id = ?", (source_id,))
+        row = cursor.fetchone()
+        if row is None:
+            api.abort(404, "Источник не найден")
+        
+        return dict(row)
+
+    @sources_ns.doc('update_source_retention')
+    @sources_ns.expect(retention_model)
+    @sources_ns.marshal_with(retention_model)
+    @retry_on_busy
+    def put(self, source_id):
+        """Задать политику хранения новостей источника"""
+        data = request.json or {}
+        values = []
+        for field in ('retention_days', 'retention_max_news'):
+            value = data.get(field)
+            if value is not None and (not isinstance(value, int) or value < 0):
+                api.abort(400, f"Поле {field} должно быть неотрицательным целым или null")
+            values.append(value)
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("UPDATE sources SET retention_days = ?, retention_max_news = ? WHERE id = ?",
+                       (*values, source_id))
+        if cursor.rowcount == 0:
+            api.abort(404, "Источник не найден")
+        conn.commit()
+        
+        return {'source_id': source_id, 'retention_days': values[0], 'retention_max_news': values[1]}
+
 @keywords_ns.route('/')
 class KeywordList(Resource):
     @keywords_ns.doc('get_keywords')
     @keywords_ns.marshal_list_with(keyword_model)
     def get(self):
         """Получить список всех ключевых слов"""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM keywords ORDER BY word")
         keywords = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
-        
         return keywords
 
     @keywords_ns.doc('create_keyword')
     @keywords_ns.expect(keyword_model)
     @keywords_ns.marshal_with(keyword_model, code=201)
+    @retry_on_busy
     def post(self):
         """Добавить новое ключевое слово"""
         data = request.json
@@ -447,36 +3771,196 @@ class KeywordList(Resource):
         if not word:
             api.abort(400, "Требуется поле word")
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
             cursor.execute("INSERT INTO keywords (word) VALUES (?)", (word,))
-            conn.commit()
             keyword_id = cursor.lastrowid
-            conn.close()
+            schedule_keyword_backfill(cursor, keyword_id)
+            conn.commit()
             
             return {"id": keyword_id, "word": word, "active": 1}, 201
         except sqlite3.IntegrityError:
-            conn.close()
             api.abort(400, "Такое ключевое слово уже существует")
 
+@keywords_ns.route('/batch')
+class KeywordBatch(Resource):
+    @keywords_ns.doc('upsert_keywords', body=[keyword_model])
+    @keywords_ns.marshal_with(batch_result_model)
+    @retry_on_busy
+    def post(self):
+        """Добавить или обновить ключевые слова списком (строки или объекты с word)"""
+        items = parse_batch_items(request.get_json(silent=True))
+        conn = get_db()
+        results = upsert_keywords(conn.cursor(), items)
+        conn.commit()
+        return batch_report(results)
+
+@keywords_ns.route('/batch/toggle')
+class KeywordBatchToggle(Resource):
+    @keywords_ns.doc('toggle_keywords')
+    @keywords_ns.marshal_with(batch_result_model)
+    @retry_on_busy
+    def post(self):
+        """Включить или выключить ключевые слова списком"""
+        items = parse_batch_items(request.get_json(silent=True))
+        conn = get_db()
+        results = toggle_batch(conn.cursor(), 'keywords', 'word', items, schedule_keyword_backfill)
+        conn.commit()
+        return batch_report(results)
+
+@keywords_ns.route('/batch/delete')
+class KeywordBatchDelete(Resource):
+    @keywords_ns.doc('delete_keywords')
+    @keywords_ns.marshal_with(batch_result_model)
+    @retry_on_busy
+    def post(self):
+        """Удалить ключевые слова списком"""
+        items = parse_batch_items(request.get_json(silent=True))
+        conn = get_db()
+        results = delete_batch(conn.cursor(), 'keywords', 'word', items, [
+            ('keyword_backfill', 'keyword_id'), ('keyword_hits', 'keyword_id'), ('keyword_source_hits', 'keyword_id')])
+        conn.commit()
+        return batch_report(results)
+
 @keywords_ns.route('/<int:keyword_id>')
 @keywords_ns.param('keyword_id', 'ID ключевого слова')
 class Keyword(Resource):
     @keywords_ns.doc('delete_keyword')
     @keywords_ns.response(204, 'Ключевое слово удалено')
+    @retry_on_busy
     def delete(self, keyword_id):
         """Удалить ключевое слово"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute("DELETE FROM keywords WHERE id = ?", (keyword_id,))
+        cursor.execute("DELETE FROM keyword_backfill WHERE keyword_id = ?", (keyword_id,))
+        cursor.execute("DELETE FROM keyword_hits WHERE keyword_id = ?", (keyword_id,))
+        cursor.execute("DELETE FROM keyword_source_hits WHERE keyword_id = ?", (keyword_id,))
         conn.commit()
-        conn.close()
         
         return '', 204
 
+@keywords_ns.route('/<int:keyword_id>/stats')
+@keywords_ns.param('keyword_id', 'ID ключевого слова')
+class KeywordStats(Resource):
+    @keywords_ns.doc('get_keyword_stats', params=STATS_PARAMS)
+    @keywords_ns.marshal_with(keyword_stats_model)
+    def get(self, keyword_id):
+        """Получить ряд совпадений по ключевому слову"""
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id, word FROM keywords WHERE id = ?", (keyword_id,))
+        keyword = cursor.fetchone()
+        if keyword is None:
+            api.abort(404, "Ключевое слово не найдено")
+        
+        period, buckets = parse_stats_window(request.args)
+        series = load_hit_series(cursor, 'keyword_hits', 'keyword_id', keyword_id, period, buckets)
+        return {
+            'keyword_id': keyword_id,
+            'word': keyword['word'],
+            'period': period,
+            'total': sum(point['hits'] for point in series),
+            'series': series,
+            'top_sources': load_top_hits(cursor, 'keyword_id', keyword_id, 'source_id', 'sources', 'name', buckets)
+        }
+
+@keywords_ns.route('/<int:keyword_id>/backfill')
+@keywords_ns.param('keyword_id', 'ID ключевого слова')
+class KeywordBackfill(Resource):
+    @keywords_ns.doc('get_keyword_backfill')
+    @keywords_ns.marshal_with(backfill_model)
+    def get(self, keyword_id):
+        """Получить ход дозаполнения по ключевому слову"""
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM keyword_backfill WHERE keyword_id = ?", (keyword_id,))
+        job = cursor.fetchone()
+        if job is None:
+            api.abort(404, "Дозаполнение для этого ключевого слова не запускалось")
+        
+        job = dict(job)
+        if job['status'] == 'done':
+            job['progress'] = 1.0
+        elif job['status'] == 'unmatched':
+            cursor.execute("SELECT MAX(id) FROM unmatched_entries")
+            last_id = cursor.fetchone()[0]
+            job['progress'] = min(job['unmatched_cursor'] / last_id, 1.0) if last_id else 1.0
+        else:
+            cursor.execute("SELECT MAX(id) FROM news")
+            last_id = cursor.fetchone()[0]
+            job['progress'] = min(job['news_cursor'] / last_id, 1.0) if last_id else 0.0
+        
+        return job
+
+    @keywords_ns.doc('start_keyword_backfill')
+    @keywords_ns.response(202, 'Дозаполнение поставлено в очередь')
+    @retry_on_busy
+    def post(self, keyword_id):
+        """Запустить дозаполнение по ключевому слову заново"""
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id FROM keywords WHERE id = ?", (keyword_id,))
+        if cursor.fetchone() is None:
+            api.abort(404, "Ключевое слово не найдено")
+        
+        schedule_keyword_backfill(cursor, keyword_id)
+        conn.commit()
+        
+        return '', 202
+
+@app.route('/metrics')
+def metrics():
+    # Гистограммы и счётчики опросов хранятся в памяти сборщика. Если он
+    # запущен отдельно (web/gunicorn + fetcher), их отдаёт его собственный
+    # /metrics (fetcher --metrics-port)
+    if not fetcher_metrics.active:
+        return Response("Метрики опросов доступны только на /metrics процесса сборщика "
+                        "(fetcher --metrics-port)\n", status=404, mimetype='text/plain')
+    return Response(fetcher_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@admin_ns.route('/storage')
+class Storage(Resource):
+    @admin_ns.doc('get_storage')
+    @admin_ns.marshal_with(storage_model)
+    def get(self):
+        """Получить размеры таблиц и индексов базы"""
+        return storage_report(get_db())
+
+@admin_ns.route('/retention')
+class Retention(Resource):
+    @admin_ns.doc('run_retention')
+    @admin_ns.marshal_with(retention_run_model)
+    def post(self):
+        """Применить политику хранения сейчас"""
+        return apply_retention(get_db())
+
+@admin_ns.route('/fetchers')
+class FetcherList(Resource):
+    @admin_ns.doc('list_fetchers')
+    @admin_ns.marshal_list_with(fetcher_model)
+    def get(self):
+        """Получить список работающих процессов сборщика"""
+        cursor = get_db().cursor()
+        cursor.execute('''
+        SELECT f.id, f.started_date, f.heartbeat, COUNT(l.source_id) AS sources
+        FROM fetchers f
+        LEFT JOIN source_leases l ON l.owner = f.id AND l.expires >= ?
+        WHERE f.heartbeat >= ?
+        GROUP BY f.id
+        ORDER BY f.started_date
+        ''', (time.time(), time.time() - SOURCE_LEASE_TTL))
+        fetchers = [dict(row) for row in cursor.fetchall()]
+        for fetcher in fetchers:
+            fetcher['heartbeat'] = datetime.fromtimestamp(fetcher['heartbeat']).isoformat()
+        return fetchers
+
 def create_templates():
     if not os.path.exists('templates'):
         os.makedirs('templates')
@@ -500,6 +3984,8 @@ def create_templates():
         .news-meta { color: #666; font-size: 14px; margin-bottom: 10px; }
         .news-content { margin-bottom: 10px; }
         .news-content img { width: 100%; height: auto; object-fit: cover; }
+        .news-item::after { content: ""; display: block; clear: both; }
+        .news-thumb { float: right; width: 160px; height: 100px; object-fit: cover; margin: 0 0 10px 15px; border-radius: 3px; }
         .news-link { color: #0066cc; }
     </style>
 </head>
@@ -519,6 +4005,9 @@ def create_templates():
         {% if news %}
             {% for item in news %}
                 <div class="news-item">
+                    {% if item.thumbnail_url %}
+                        <img class="news-thumb" src="{{ item.thumbnail_url }}" alt="" loading="lazy">
+                    {% endif %}
                     <h3 class="news-title">{{ item.title }}</h3>
                     <div class="news-meta">
                         Источник: {{ item.source_name }} | 
@@ -526,7 +4015,8 @@ def create_templates():
                         Найдено: {{ item.found_date }} |
                         Ключевые слова: {{ item.keywords }}
                     </div>
-                    <div class="news-content">{{ item.content | safe }}</div>
+                    <div class="news-content">{{ item.summary or '' }}</div>
+                    <span class="news-more"><a href="#" class="news-link" onclick="return showContent(this, {{ item.id }})">Показать полностью</a> | </span>
                     <a href="{{ item.url }}" target="_blank" class="news-link">Читать источник</a>
                 </div>
             {% endfor %}
@@ -534,6 +4024,20 @@ def create_templates():
             <p>Новостей пока нет. Добавьте источники и ключевые слова.</p>
         {% endif %}
     </div>
+    <script>
+        function showContent(link, id) {
+            var item = link.closest('.news-item');
+            fetch('/news/' + id)
+                .then(function (response) { return response.json(); })
+                .then(function (news) {
+                    item.querySelector('.news-content').innerHTML = news.content;
+                    var thumb = item.querySelector('.news-thumb');
+                    if (thumb) { thumb.remove(); }
+                    link.parentNode.remove();
+                });
+            return false;
+        }
+    </script>
 </body>
 </html>
         ''')
@@ -708,12 +4212,101 @@ def create_templates():
 </html>
         ''')
 
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    # /metrics отдельного процесса сборщика: у веб-воркеров своих
+    # метрик сбора нет, Prometheus опрашивает каждый сборщик напрямую
+    def do_GET(self):
+        if urlsplit(self.path).path != '/metrics':
+            self.send_error(404)
+            return
+        body = fetcher_metrics.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port):
+    server = http.server.ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"[{datetime.now()}] Метрики сборщика доступны на порту {port}")
+
+def start_maintenance():
+    # Дозаполнение и архивирование пишут в общую базу и не
+    # распределяются арендой - их запускает ровно один процесс
+    threading.Thread(target=run_keyword_backfill, daemon=True).start()
+    threading.Thread(target=run_news_backfill, args=(fingerprint_news_chunk, 'Отпечатки новостей'),
+                     daemon=True).start()
+    threading.Thread(target=run_news_backfill, args=(summarize_news_chunk, 'Краткие описания новостей'),
+                     daemon=True).start()
+    threading.Thread(target=run_retention, daemon=True).start()
+
+def wait_for_shutdown():
+    # SIGTERM и Ctrl+C останавливают процесс штатно: сборщик успевает
+    # освободить аренду источников
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stop_event.set())
+    return stop_event
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='RSS Monitor. Без команды веб-приложение и сборщик работают в одном процессе')
+    commands = parser.add_subparsers(dest='command')
+    
+    web = commands.add_parser('web', help='только веб-приложение, без фоновых задач '
+                                          '(для нескольких воркеров: gunicorn -w 4 main:app)')
+    web.add_argument('--host', default='0.0.0.0')
+    web.add_argument('--port', type=int, default=5000)
+    
+    fetcher = commands.add_parser('fetcher', help='только сборщик новостей; процессов может быть несколько')
+    fetcher.add_argument('--workers', type=int, default=FETCH_WORKERS, help='потоков загрузки лент')
+    fetcher.add_argument('--parse-processes', type=int, default=PARSE_PROCESSES, help='процессов разбора лент')
+    fetcher.add_argument('--metrics-port', type=int, help='порт для /metrics сборщика')
+    fetcher.add_argument('--maintenance', action='store_true',
+                         help='также выполнять дозаполнение ключевых слов и архивирование')
+    
+    commands.add_parser('maintenance', help='только дозаполнение ключевых слов и архивирование (один процесс)')
+    commands.add_parser('vacuum', help='включить инкрементальный auto_vacuum в существующей базе '
+                                       '(перестройка файла; остальные процессы должны быть остановлены)')
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
     init_db()
     
     create_templates()
     
-    rss_thread = threading.Thread(target=fetch_rss_news, daemon=True)
-    rss_thread.start()
-    
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    if args.command == 'web':
+        app.run(host=args.host, port=args.port, threaded=True)
+    elif args.command == 'fetcher':
+        FETCH_WORKERS = args.workers
+        PARSE_PROCESSES = args.parse_processes
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        if args.maintenance:
+            start_maintenance()
+        fetch_rss_news(wait_for_shutdown())
+    elif args.command == 'maintenance':
+        start_maintenance()
+        wait_for_shutdown().wait()
+    elif args.command == 'vacuum':
+        try:
+            enable_incremental_vacuum(connect_db())
+        except sqlite3.OperationalError as e:
+            print(f"[{datetime.now()}] Не удалось перестроить базу: {e}")
+            sys.exit(1)
+    else:
+        # news_bus по-прежнему опрашивает БД: источники могут быть арендованы
+        # и другими процессами fetcher
+        rss_thread = threading.Thread(target=fetch_rss_news, daemon=True)
+        rss_thread.start()
+        
+        start_maintenance()
+        
+        # Без перезагрузчика Werkzeug: его родительский процесс тоже запустил
+        # бы сборщик и фоновые задачи
+        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,97 @@
+import os
+import random
+import tempfile
+import unittest
+
+import main
+
+TITLE = 'Центробанк сохранил ключевую ставку'
+TEXT = ('Совет директоров Банка России на заседании в пятницу сохранил ключевую ставку на уровне 16 процентов годовых. '
+        'Регулятор отметил, что инфляционное давление постепенно снижается, однако риски для цен остаются высокими. '
+        'Следующее заседание по ставке запланировано на середину декабря, сообщила пресс-служба ЦБ.')
+OTHER_TITLE = 'Минфин разместил облигации федерального займа'
+OTHER_TEXT = ('Министерство финансов в среду разместило облигации федерального займа на сумму 40 миллиардов рублей. '
+              'Спрос инвесторов превысил предложение почти вдвое, а средневзвешенная доходность составила 15 процентов '
+              'годовых. Следующий аукцион ведомство проведёт на следующей неделе, сообщила пресс-служба Минфина.')
+
+
+def distance(first, second):
+    return bin(first ^ second).count('1')
+
+
+class ShortTextDuplicateTest(unittest.TestCase):
+    # Описания в RSS короткие (~40 слов): перепечатка отличается подписью
+    # источника или вводной фразой агентства
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = main.DB_PATH
+        main.DB_PATH = os.path.join(self.directory.name, 'test.db')
+        main.init_db()
+        self.conn = main.connect_db()
+        self.conn.row_factory = main.sqlite3.Row
+        self.conn.execute("INSERT INTO sources (name, url) VALUES ('a', 'http://a/rss'), ('b', 'http://b/rss')")
+        self.conn.execute("INSERT INTO keywords (word) VALUES ('ставку'), ('ЦБ')")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        main.DB_PATH = self.db_path
+        self.directory.cleanup()
+
+    def item(self, url, title, content, source_id, keyword_ids, found_date='2026-10-18T10:15:00'):
+        return {'title': title, 'content': content, 'url': url, 'source_id': source_id,
+                'published_date': '', 'found_date': found_date, 'summary': main.make_summary(content),
+                'thumbnail_url': None, 'keyword_ids': keyword_ids}
+
+    def test_syndicated_copies_are_near_duplicates(self):
+        original = main.news_fingerprint(TITLE, TEXT)
+        for copy in (TEXT + ' Подписывайтесь на наш канал в Telegram.',
+                     TEXT + ' Читайте также: новости экономики на нашем сайте.',
+                     'МОСКВА, 18 октября. ' + TEXT):
+            self.assertLessEqual(distance(original, main.news_fingerprint(TITLE, copy)), main.SIMHASH_MAX_DISTANCE)
+        self.assertGreater(distance(original, main.news_fingerprint(OTHER_TITLE, OTHER_TEXT)),
+                           main.SIMHASH_MAX_DISTANCE)
+
+    def test_one_appended_word_usually_stays_within_threshold(self):
+        words = TEXT.split()
+        rng = random.Random(1)
+        within = 0
+        for _ in range(200):
+            text = ' '.join(rng.sample(words, len(words)))
+            fingerprint = main.news_fingerprint(TITLE, text)
+            within += distance(fingerprint, main.news_fingerprint(TITLE, f'{text} слово{rng.randrange(10 ** 6)}')) \
+                <= main.SIMHASH_MAX_DISTANCE
+        self.assertGreaterEqual(within, 180)
+
+    def test_band_probes_find_every_fingerprint_within_threshold(self):
+        rng = random.Random(2)
+        cursor = self.conn.cursor()
+        fingerprint = rng.getrandbits(main.SIMHASH_BITS)
+        for news_id in range(1, 101):
+            bits = rng.sample(range(main.SIMHASH_BITS), rng.randint(0, main.SIMHASH_MAX_DISTANCE))
+            cursor.execute("DELETE FROM news_simhash")
+            main.store_news_fingerprint(cursor, news_id, fingerprint ^ sum(1 << bit for bit in bits))
+            self.assertEqual(main.find_near_duplicate(cursor, fingerprint), (news_id, len(bits)))
+
+    def test_keywords_moved_to_original_are_counted_once(self):
+        main.write_news_batch(self.conn, [self.item('http://a/1', TITLE, TEXT, 1, [1])], {1: 'ставку', 2: 'ЦБ'})
+        copy = self.item('http://b/1', TITLE, TEXT + ' Подписывайтесь на наш канал в Telegram.', 2, [1, 2],
+                         found_date='2026-10-19T08:00:00')
+        self.assertEqual(main.write_news_batch(self.conn, [copy], {1: 'ставку', 2: 'ЦБ'}), [])
+        self.assertEqual(copy['duplicate_of'], 1)
+
+        hits = {(row['keyword_id'], row['bucket']): row['hits'] for row in self.conn.execute(
+            "SELECT keyword_id, bucket, hits FROM keyword_hits WHERE period = 'day'")}
+        # Связь ЦБ учтена у оригинала (источник a, его день), ставка - один раз
+        self.assertEqual(hits, {(1, '2026-10-18'): 1, (2, '2026-10-18'): 1})
+        pairs = {(row['keyword_id'], row['source_id']): row['hits'] for row in self.conn.execute(
+            "SELECT keyword_id, source_id, hits FROM keyword_source_hits")}
+        self.assertEqual(pairs, {(1, 1): 1, (2, 1): 1})
+        sources = {row['source_id']: row['hits'] for row in self.conn.execute(
+            "SELECT source_id, hits FROM source_hits WHERE period = 'day'")}
+        self.assertEqual(sources, {1: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()